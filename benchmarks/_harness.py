@@ -0,0 +1,69 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+from types import SimpleNamespace
+import numpy as np
+import pyarrow as pa
+
+@contextmanager
+def timed():
+    """
+    Time the enclosed block with a monotonic, high-resolution clock.
+    The elapsed time in seconds is available as `timer.elapsed` after the block.
+    """
+    timer = SimpleNamespace(elapsed=0.0)
+    start = time.perf_counter_ns()
+    try:
+        yield timer
+    finally:
+        timer.elapsed = (time.perf_counter_ns() - start) / 1e9
+
+def measure_memory(func, *args, **kwargs):
+    """
+    Measure the peak memory allocated during the execution of a function, in MiB.
+    Python and NumPy allocations are traced with tracemalloc; memory still held by
+    Arrow's allocator when the function returns is added on top.
+    Returns the peak memory and the function's result.
+    """
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    peak += max(pa.total_allocated_bytes() - arrow_before, 0)
+    return peak / (1024 * 1024), result
+
+def benchmark_querying(ds, query_func, iterations=3):
+    total_time = 0.0
+    for _ in range(iterations):
+        with timed() as timer:
+            query_func(ds)
+        total_time += timer.elapsed
+    return total_time / iterations
+
+def benchmark_batch_reading(ds, batch_size, iterations=3, random_access=False, batch_indexing=False):
+    """
+    Benchmark reading the whole dataset in batches, sequentially or in random order.
+    With `batch_indexing`, random batches are read by indexing the dataset with an array of
+    indices; otherwise the spectra of a random batch are read one by one.
+    Returns the average time of reading the dataset once.
+    """
+    total_time = 0.0
+    if random_access:
+        # One fixed permutation for all iterations, so that its generation is not timed
+        indices = np.random.default_rng(42).permutation(len(ds))
+    for _ in range(iterations):
+        with timed() as timer:
+            if random_access:
+                for idx in range(0, len(indices), batch_size):
+                    if batch_indexing:
+                        _ = ds[indices[idx:idx + batch_size]]
+                    else:
+                        _ = [ds[j] for j in indices[idx:idx + batch_size]]
+            else:
+                for idx in range(0, len(ds), batch_size):
+                    _ = ds[idx:idx + batch_size]
+        total_time += timer.elapsed
+    return total_time / iterations
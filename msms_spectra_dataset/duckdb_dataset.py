@@ -1,11 +1,100 @@
 import duckdb
-import pandas as pd  # Add pandas import
-from typing import List, Union
-from msms_spectra_dataset.in_memory_dataset import InMemoryMGFSpectraDataset
-
-
-class DuckDBSpectraDataset:
-    def __init__(self, duckdb_file: str, mgf_files: List[str] = None, sequential_mode: bool = False, chunk_size: int = 100000):
+import numpy as np
+import pyarrow as pa
+from typing import List, Optional, Sequence, Union
+from msms_spectra_dataset.mgf_parser import parse_mgf_files
+from msms_spectra_dataset.sequential import COUNT_QUERY, SequentialChunksMixin, batch_query, range_query
+
+_COLUMNS = ["id", "precursor_mz", "precursor_charge", "retention_time", "mz", "intensity"]
+_RANGE_QUERY = range_query(_COLUMNS)
+_BATCH_QUERY = batch_query(_COLUMNS)
+
+
+def _fetch_arrow_table(result: duckdb.DuckDBPyConnection) -> pa.Table:
+    """
+    Fetch the result of an executed query as an Arrow table.
+    Newer DuckDB versions renamed `fetch_arrow_table` to `to_arrow_table`.
+    """
+    if hasattr(result, "to_arrow_table"):
+        return result.to_arrow_table()
+    return result.fetch_arrow_table()
+
+
+def _peaks_to_blobs(offsets: np.ndarray, values: np.ndarray) -> pa.LargeBinaryArray:
+    """
+    Wrap CSR peak values as one BLOB of little-endian float32 values per spectrum, without copying.
+
+    Args:
+        offsets (np.ndarray): Offsets of the spectra in `values`, of length n + 1.
+        values (np.ndarray): Concatenated float32 peak values.
+
+    Returns:
+        pa.LargeBinaryArray: The peak values of every spectrum.
+    """
+    byte_offsets = pa.array(offsets * np.dtype(np.float32).itemsize, pa.int64())
+    data = pa.py_buffer(np.ascontiguousarray(values, dtype="<f4"))
+    return pa.LargeBinaryArray.from_buffers(pa.large_binary(), len(offsets) - 1, [None, byte_offsets.buffers()[1], data])
+
+
+def _blobs_to_lists(column: pa.ChunkedArray) -> pa.LargeListArray:
+    """
+    Reinterpret a column of float32 peak BLOBs as a `large_list<float32>` array, without copying the values.
+    """
+    blobs = column.combine_chunks().cast(pa.large_binary())
+    _, offsets_buffer, data_buffer = blobs.buffers()
+    byte_offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[blobs.offset:blobs.offset + len(blobs) + 1]
+    itemsize = np.dtype(np.float32).itemsize
+    if data_buffer is None:
+        values = np.empty(0, dtype=np.float32)
+    else:
+        values = np.frombuffer(data_buffer, dtype=np.uint8)[:byte_offsets[-1]].view("<f4")
+    return pa.LargeListArray.from_arrays(pa.array(byte_offsets // itemsize, pa.int64()), pa.array(values, pa.float32()))
+
+
+def _with_peak_lists(table: pa.Table) -> pa.Table:
+    """
+    Replace the mz and intensity BLOB columns of a fetched table by `large_list<float32>` columns.
+    """
+    for name in ("mz", "intensity"):
+        table = table.set_column(table.schema.get_field_index(name), name, _blobs_to_lists(table.column(name)))
+    return table
+
+
+class _SpectrumRows:
+    """
+    The spectra of a fetched Arrow table, kept as columns. The dictionary of a spectrum is only
+    built when it is accessed, and its peaks are read-only views of the Arrow values buffers.
+    """
+
+    def __init__(self, table: pa.Table):
+        # Scalars and offsets are converted column by column in C; indexing Python lists is
+        # much cheaper than indexing NumPy arrays element by element
+        self.ids, self.precursor_mz, self.precursor_charge, self.retention_time = (
+            table.column(name).to_pylist() for name in ("id", "precursor_mz", "precursor_charge", "retention_time")
+        )
+        self.peaks = []
+        for name in ("mz", "intensity"):
+            lists = table.column(name).combine_chunks()
+            self.peaks.append((lists.values.to_numpy(zero_copy_only=True), lists.offsets.to_numpy().tolist()))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int) -> dict:
+        (mz, mz_offsets), (intensity, intensity_offsets) = self.peaks
+        return {
+            "id": self.ids[i],
+            "precursor_mz": self.precursor_mz[i],
+            "precursor_charge": self.precursor_charge[i],
+            "retention_time": self.retention_time[i],
+            "mz": mz[mz_offsets[i]:mz_offsets[i + 1]],
+            "intensity": intensity[intensity_offsets[i]:intensity_offsets[i + 1]],
+        }
+
+
+class DuckDBSpectraDataset(SequentialChunksMixin):
+    def __init__(self, duckdb_file: str, mgf_files: List[str] = None, sequential_mode: bool = False, chunk_size: int = 100000,
+                 num_workers: Optional[int] = None):
         """
         Initialize the dataset with DuckDB.
         Optionally load spectra from MGF files.
@@ -15,15 +104,19 @@ class DuckDBSpectraDataset:
             mgf_files (List[str], optional): List of MGF files to load spectra from.
             sequential_mode (bool): If True, enable sequential mode with chunked preloading.
             chunk_size (int): Number of spectra to preload in sequential mode.
+            num_workers (int, optional): Number of processes used to parse the MGF files in parallel.
+                Defaults to the number of CPUs; 1 parses all files in the current process.
         """
         self.duckdb_file = duckdb_file
+        self.num_workers = num_workers
         self.conn = duckdb.connect(duckdb_file)
         self.sequential_mode = sequential_mode
         self.chunk_size = chunk_size
-        self.current_chunk = []
-        self.current_chunk_start = 0
+        self._init_chunks()
 
-        # Create a single table for spectra with mz and intensity as arrays
+        # Create a single table for spectra. The peaks of every spectrum are stored as BLOBs of
+        # float32 values (a CSR layout: the BLOB lengths are the offsets), which is much faster
+        # to ingest and to fetch by row ID than REAL[] lists.
         self.conn.execute(
             """
             CREATE TABLE IF NOT EXISTS spectra (
@@ -31,11 +124,21 @@ class DuckDBSpectraDataset:
                 precursor_mz REAL,
                 precursor_charge INTEGER,
                 retention_time REAL,
-                mz REAL[],  -- mz values as an array
-                intensity REAL[]  -- intensity values as an array
+                mz BLOB,  -- mz values as little-endian float32
+                intensity BLOB  -- intensity values as little-endian float32
             )
             """
         )
+        # Files written before the BLOB layout store the peaks as REAL[] lists, which cannot be read
+        mz_type = self.conn.execute(
+            "SELECT data_type FROM information_schema.columns WHERE table_name = 'spectra' AND column_name = 'mz'"
+        ).fetchone()[0]
+        if mz_type != "BLOB":
+            self.conn.close()
+            raise ValueError(
+                f"{duckdb_file} stores peaks as {mz_type} instead of BLOB; it was created by an older "
+                "version of this package. Delete it and recreate it from the MGF files."
+            )
 
         if mgf_files:
             self._load_spectra_from_mgf(mgf_files)
@@ -50,72 +153,73 @@ class DuckDBSpectraDataset:
         Args:
             mgf_files (List[str]): List of MGF files to load spectra from.
         """
-        if self.conn.execute("SELECT COUNT(*) FROM spectra").fetchone()[0] > 0:
+        if self.conn.execute(COUNT_QUERY).fetchone()[0] > 0:
             return
 
-        spectra_to_insert = []
+        # Insert the parsed columns of every file as an Arrow table, which DuckDB scans without copying
+        parsed = parse_mgf_files(mgf_files, self.num_workers)
         for mgf_file in mgf_files:
-            for spec in InMemoryMGFSpectraDataset([mgf_file]):
-                spectra_to_insert.append((
-                    spec.identifier,
-                    spec.precursor_mz,
-                    spec.precursor_charge,
-                    spec.retention_time,
-                    spec.mz,
-                    spec.intensity,
-                ))
-
-        df = pd.DataFrame(spectra_to_insert, columns=[
-            "id", "precursor_mz", "precursor_charge", "retention_time", "mz", "intensity"
-        ])
-        self.conn.register("temp_df", df)
-
-        self.conn.execute("""
-            INSERT INTO spectra (id, precursor_mz, precursor_charge, retention_time, mz, intensity)
-            SELECT id, precursor_mz, precursor_charge, retention_time, mz, intensity FROM temp_df
-        """)
-
-    def get_spectrum_batch_by_rowids(self, rowids: List[int]) -> List[dict]:
+            columns = parsed[mgf_file]
+            if len(columns) == 0:
+                continue
+            table = pa.table({
+                "id": columns.titles,
+                "precursor_mz": columns.precursor_mz,
+                "precursor_charge": columns.precursor_charge,
+                "retention_time": columns.retention_time,
+                "mz": _peaks_to_blobs(columns.offsets, columns.mz_values),
+                "intensity": _peaks_to_blobs(columns.offsets, columns.intensity_values),
+            })
+            self.conn.register("arrow_tbl", table)
+            try:
+                self.conn.execute("""
+                    INSERT INTO spectra (id, precursor_mz, precursor_charge, retention_time, mz, intensity)
+                    SELECT id, precursor_mz, precursor_charge, retention_time, mz, intensity FROM arrow_tbl
+                """)
+            finally:
+                self.conn.unregister("arrow_tbl")
+        self._n = None
+
+    def get_batch_arrow(self, rowids: Union[Sequence[int], np.ndarray], *, already_sorted: bool = False) -> pa.Table:
+        """
+        Retrieve multiple spectra by their row IDs as an Arrow table, without converting
+        the values to Python objects.
+
+        Args:
+            rowids (Union[Sequence[int], np.ndarray]): Row IDs to retrieve.
+            already_sorted (bool): If True, the row IDs are known to be in ascending order and are not sorted again.
+
+        Returns:
+            pa.Table: One row per spectrum, ordered by row ID, with the columns rowid, id,
+                precursor_mz, precursor_charge, retention_time, mz and intensity. The peak columns
+                are `large_list<float32>` arrays sharing the fetched BLOB buffers.
+        """
+        rowids = np.asarray(rowids, dtype=np.int64)
+        if not already_sorted:
+            rowids = np.sort(rowids)
+        self.conn.register("rowid_tbl", pa.table({"rowid": rowids}))
+        try:
+            table = _fetch_arrow_table(self.conn.execute(_BATCH_QUERY))
+        finally:
+            self.conn.unregister("rowid_tbl")
+        return _with_peak_lists(table)
+
+    def get_spectrum_batch_by_rowids(self, rowids: Union[Sequence[int], np.ndarray], *, already_sorted: bool = False) -> List[dict]:
         """
         Retrieve multiple spectra by their row IDs in a single batch.
 
         Args:
-            rowids (List[int]): List of row IDs to retrieve.
+            rowids (Union[Sequence[int], np.ndarray]): Row IDs to retrieve.
+            already_sorted (bool): If True, the row IDs are known to be in ascending order and are not sorted again.
 
         Returns:
             List[dict]: List of retrieved spectra as dictionaries.
         """
-        if not rowids:
+        if len(rowids) == 0:
             return []
 
-        rowids = sorted(rowids)
-        # Fetch spectra with mz and intensity arrays
-        query = f"""
-            SELECT 
-                rowid,
-                id,
-                precursor_mz,
-                precursor_charge,
-                retention_time,
-                mz,
-                intensity
-            FROM spectra
-            WHERE rowid IN ({','.join(map(str, rowids))})
-            ORDER BY rowid
-        """
-        rows = self.conn.execute(query).fetchall()
-
-        return [
-            {
-                "id": row[1],
-                "precursor_mz": row[2],
-                "precursor_charge": row[3],
-                "retention_time": row[4],
-                "mz": row[5] or [],
-                "intensity": row[6] or [],
-            }
-            for row in rows
-        ]
+        rows = _SpectrumRows(self.get_batch_arrow(rowids, already_sorted=already_sorted))
+        return [rows[i] for i in range(len(rows))]
 
     def query(self, filter_query: str) -> List[dict]:
         """
@@ -135,87 +239,27 @@ class DuckDBSpectraDataset:
         return self.get_spectrum_batch_by_rowids(rowids)
 
 
-    def _load_chunk(self, start_rowid: int):
+    def _fetch_chunk(self, conn: duckdb.DuckDBPyConnection, start_rowid: int) -> _SpectrumRows:
         """
-        Load a chunk of spectra into memory starting from the given row ID.
+        Fetch a chunk of spectra starting from the given row ID as columns; the dictionary of
+        a spectrum is only built when it is accessed.
 
         Args:
+            conn (duckdb.DuckDBPyConnection): The connection or cursor to query.
             start_rowid (int): The starting row ID for the chunk.
-        """
-        query = f"""
-            SELECT rowid, id, precursor_mz, precursor_charge, retention_time, mz, intensity
-            FROM spectra
-            WHERE rowid BETWEEN {start_rowid} AND {start_rowid + self.chunk_size - 1}
-        """
-        rows = self.conn.execute(query).fetchall()
-
-        # Convert rows to dictionaries
-        self.current_chunk = [
-            {
-                "id": row[1],
-                "precursor_mz": row[2],
-                "precursor_charge": row[3],
-                "retention_time": row[4],
-                "mz": row[5],
-                "intensity": row[6],
-            }
-            for row in rows
-        ]
-        self.current_chunk_start = start_rowid
-
-    def _get_from_chunk(self, idx: int) -> dict:
-        """
-        Retrieve a spectrum from the current chunk.
-
-        Args:
-            idx (int): The index of the spectrum to retrieve.
 
         Returns:
-            dict: The retrieved spectrum as a dictionary.
+            _SpectrumRows: The spectra of the chunk.
         """
-        chunk_start = (idx // self.chunk_size) * self.chunk_size
-
-        # If the index is outside the current chunk, load the appropriate chunk
-        if not self.current_chunk or idx < self.current_chunk_start or idx >= self.current_chunk_start + len(self.current_chunk):
-            query = f"""
-                SELECT 
-                    rowid,
-                    id,
-                    precursor_mz,
-                    precursor_charge,
-                    retention_time,
-                    mz,
-                    intensity
-                FROM spectra
-                WHERE rowid BETWEEN {chunk_start} AND {chunk_start + self.chunk_size - 1}
-                ORDER BY rowid
-            """
-            rows = self.conn.execute(query).fetchall()
-
-            # Convert rows to dictionaries
-            self.current_chunk = [
-                {
-                    "id": row[1],
-                    "precursor_mz": row[2],
-                    "precursor_charge": row[3],
-                    "retention_time": row[4],
-                    "mz": row[5] or [],
-                    "intensity": row[6] or [],
-                }
-                for row in rows
-            ]
-            self.current_chunk_start = chunk_start
-
-        # Adjust the index relative to the current chunk and return the spectrum
-        relative_idx = idx - self.current_chunk_start
-        return self.current_chunk[relative_idx]
-
-    def __getitem__(self, idx: Union[int, slice, List[int]]) -> Union[dict, List[dict]]:
+        result = conn.execute(_RANGE_QUERY, [start_rowid, start_rowid + self.chunk_size - 1])
+        return _SpectrumRows(_with_peak_lists(_fetch_arrow_table(result)))
+
+    def __getitem__(self, idx: Union[int, slice, List[int], np.ndarray]) -> Union[dict, List[dict]]:
         """
         Retrieve spectra by index, slice, or list of indices.
 
         Args:
-            idx (Union[int, slice, List[int]]): Index, slice, or list of indices of spectra to retrieve.
+            idx (Union[int, slice, List[int], np.ndarray]): Index, slice, or list or array of indices of spectra to retrieve.
 
         Returns:
             Union[dict, List[dict]]: The retrieved spectrum or list of spectra.
@@ -226,43 +270,19 @@ class DuckDBSpectraDataset:
                 stop = min(idx.stop if idx.stop is not None else len(self), len(self))
                 step = idx.step or 1
                 return [self._get_from_chunk(i) for i in range(start, stop, step)]
-            elif isinstance(idx, list):
+            elif isinstance(idx, (list, np.ndarray)):
                 return [self._get_from_chunk(i) for i in idx]
             else:
                 return self._get_from_chunk(idx)
         if isinstance(idx, slice):
-            rowids = list(range(idx.start or 0, idx.stop or len(self), idx.step or 1))
-        elif isinstance(idx, list):
+            rowids = np.arange(*idx.indices(len(self)))
+            already_sorted = (idx.step or 1) > 0
+        elif isinstance(idx, (list, np.ndarray)):
             rowids = idx
+            already_sorted = False
         else:
             rowids = [idx]
+            already_sorted = True
 
-        return self.get_spectrum_batch_by_rowids(rowids) if isinstance(idx, (slice, list)) else self.get_spectrum_batch_by_rowids(rowids)[0]
-
-    def __len__(self):
-        """
-        Get the number of spectra in the dataset.
-
-        Returns:
-            int: The number of spectra.
-        """
-        return self.conn.execute("SELECT COUNT(*) FROM spectra").fetchone()[0]
-
-    def __enter__(self):
-        """
-        Enable the use of the dataset as a context manager.
-        """
-        return self
-
-    def __exit__(self, exc_type, exc_value, traceback):
-        """
-        Ensure the connections are closed when exiting the context.
-        """
-        self.close()
-
-    def close(self):
-        """
-        Close the DuckDB connection.
-        """
-        if self.conn:
-            self.conn.close()
+        result = self.get_spectrum_batch_by_rowids(rowids, already_sorted=already_sorted)
+        return result if isinstance(idx, (slice, list, np.ndarray)) else result[0]
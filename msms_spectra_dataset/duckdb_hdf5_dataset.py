@@ -1,14 +1,50 @@
 import duckdb
 import h5py
+from h5py import h5s
 import numpy as np
-import pandas as pd
-from typing import List, Union
-from msms_spectra_dataset.in_memory_dataset import InMemoryMGFSpectraDataset
-
-
-class DuckDBHDF5SpectraDataset:
+import pyarrow as pa
+from typing import List, Optional, Sequence, Tuple, Union
+from msms_spectra_dataset.mgf_parser import parse_mgf_files
+from msms_spectra_dataset.sequential import COUNT_QUERY, SequentialChunksMixin, batch_query, range_query
+from msms_spectra_dataset.utils import concatenate_columns
+
+_COLUMNS = ["id", "precursor_mz", "precursor_charge", "retention_time"]
+_RANGE_QUERY = range_query(_COLUMNS)
+_BATCH_QUERY = batch_query(_COLUMNS)
+
+
+# Gaps of up to this many values (4 KiB of float32) between requested blocks are read
+# rather than skipped, which keeps the selection small for dense batches
+_MAX_GAP = 1024
+
+
+def _coalesce_blocks(starts: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merge sorted, possibly overlapping or duplicated blocks that are at most `_MAX_GAP`
+    values apart into larger blocks.
+
+    Args:
+        starts (np.ndarray): Sorted start positions of the blocks.
+        counts (np.ndarray): Lengths of the blocks.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The starts and stops of the merged blocks, and the
+            position of every input block in the concatenation of the merged blocks.
+    """
+    ends = starts + counts
+    new_block = np.flatnonzero(starts[1:] > ends[:-1] + _MAX_GAP) + 1
+    first = np.concatenate(([0], new_block))
+    block_starts = starts[first]
+    block_stops = ends[np.concatenate((new_block - 1, [len(ends) - 1]))]
+    sizes = block_stops - block_starts
+    block_of = np.repeat(np.arange(len(first)), np.diff(np.append(first, len(starts))))
+    positions = (np.cumsum(sizes) - sizes)[block_of] + starts - block_starts[block_of]
+    return block_starts, block_stops, positions
+
+
+class DuckDBHDF5SpectraDataset(SequentialChunksMixin):
     def __init__(self, duckdb_file: str, hdf5_file: str, mgf_files: List[str] = None,
-                 sequential_mode: bool = False, chunk_size: int = 100000):
+                 sequential_mode: bool = False, chunk_size: int = 100000, num_workers: Optional[int] = None):
         """
         Initialize the DuckDB and HDF5 dataset.
         Args:
@@ -17,14 +53,16 @@ class DuckDBHDF5SpectraDataset:
             mgf_files (List[str]): List of MGF files to load spectra from.
             sequential_mode (bool): If True, load spectra in chunks for sequential access.
             chunk_size (int): Size of each chunk to load in sequential mode.
+            num_workers (int, optional): Number of processes used to parse the MGF files in parallel.
+                Defaults to the number of CPUs; 1 parses all files in the current process.
         """
         self.duckdb_file = duckdb_file
+        self.num_workers = num_workers
         self.hdf5_file = hdf5_file
         self.conn = duckdb.connect(duckdb_file)
         self.sequential_mode = sequential_mode
         self.chunk_size = chunk_size
-        self.current_chunk = []
-        self.current_chunk_start = 0
+        self._init_chunks()
 
         self.conn.execute("""
             CREATE TABLE IF NOT EXISTS spectra (
@@ -38,64 +76,109 @@ class DuckDBHDF5SpectraDataset:
             self._load_spectra_from_mgf(mgf_files)
 
         self.h5 = h5py.File(self.hdf5_file, "r")
+        missing = [name for name in ("offsets", "mz_values", "intensity_values") if name not in self.h5]
+        if missing:
+            # E.g. files written before the CSR layout, which kept the peaks in one "spectra" vlen dataset
+            self.h5.close()
+            self.conn.close()
+            raise ValueError(
+                f"{hdf5_file} has no {', '.join(missing)} dataset(s); it was not written in the CSR peak layout "
+                "of this version. Delete it and recreate it from the MGF files."
+            )
+        # The peaks of spectrum i are mz_values[offsets[i]:offsets[i + 1]] (and likewise for intensities)
+        self.offsets = self.h5["offsets"][:]
 
         if self.sequential_mode:
             self._load_chunk(0)
 
     def _load_spectra_from_mgf(self, mgf_files: List[str]):
-        if self.conn.execute("SELECT COUNT(*) FROM spectra").fetchone()[0] > 0:
+        if self.conn.execute(COUNT_QUERY).fetchone()[0] > 0:
             return
 
-        spectra_to_insert = []
-        spectra = []
-        for mgf_file in mgf_files:
-            for spec in InMemoryMGFSpectraDataset([mgf_file]):
-                spectra_to_insert.append((
-                    spec.identifier,
-                    spec.precursor_mz,
-                    spec.precursor_charge,
-                    spec.retention_time
-                ))
-                spectra.append((spec.mz, spec.intensity))
-
-        df = pd.DataFrame(spectra_to_insert, columns=[
-            "id", "precursor_mz", "precursor_charge", "retention_time"
-        ])
-        self.conn.register("temp_df", df)
-        self.conn.execute("""
-            INSERT INTO spectra (id, precursor_mz, precursor_charge, retention_time)
-            SELECT id, precursor_mz, precursor_charge, retention_time FROM temp_df
-        """)
-
+        # Use the parsed columns directly, without constructing an MsmsSpectrum per spectrum
+        parsed = parse_mgf_files(mgf_files, self.num_workers)
+        columns = concatenate_columns([parsed[mgf_file] for mgf_file in mgf_files])
+        # Insert the metadata columns as an Arrow table, which DuckDB scans without copying
+        table = pa.table({
+            "id": columns.titles,
+            "precursor_mz": columns.precursor_mz,
+            "precursor_charge": columns.precursor_charge,
+            "retention_time": columns.retention_time,
+        })
+        self.conn.register("arrow_tbl", table)
+        try:
+            self.conn.execute("""
+                INSERT INTO spectra (id, precursor_mz, precursor_charge, retention_time)
+                SELECT id, precursor_mz, precursor_charge, retention_time FROM arrow_tbl
+            """)
+        finally:
+            self.conn.unregister("arrow_tbl")
+
+        # Store the peaks in CSR layout: all values in two contiguous 1-D datasets plus the offsets
+        # of every spectrum. Compression barely shrinks the float values but slows down random reads.
         with h5py.File(self.hdf5_file, "w") as f:
-            dt = h5py.vlen_dtype(np.float32)
-            spectra_ds = f.create_dataset("spectra", shape=(len(spectra), 2), dtype=dt)
-            for i, (mz, intensity) in enumerate(spectra):
-                spectra_ds[i, 0] = mz
-                spectra_ds[i, 1] = intensity
-
-    def get_spectrum_batch_by_rowids(self, rowids: List[int]) -> List[dict]:
-        if not rowids:
-            return []
+            f.create_dataset("offsets", data=columns.offsets, dtype="i8")
+            f.create_dataset("mz_values", data=columns.mz_values, dtype="f4")
+            f.create_dataset("intensity_values", data=columns.intensity_values, dtype="f4")
+        self._n = None
+
+    def _read_peaks(self, rowids: np.ndarray) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """
+        Read the peaks of the given spectra with one read per dataset. The requested ranges are
+        coalesced and combined into a single hyperslab selection, which is shared by both datasets.
+
+        Args:
+            rowids (np.ndarray): Sorted row IDs, possibly with duplicates.
 
-        rowids = sorted(rowids)
-        query = f"""
-            SELECT id, precursor_mz, precursor_charge, retention_time
-            FROM spectra
-            WHERE rowid IN ({','.join(map(str, rowids))})
+        Returns:
+            Tuple[List[np.ndarray], List[np.ndarray]]: The m/z and intensity arrays of every spectrum.
         """
-        rows = self.conn.execute(query).fetchall()
+        starts = self.offsets[rowids]
+        counts = self.offsets[rowids + 1] - starts
+        block_starts, block_stops, positions = _coalesce_blocks(starts, counts)
+
+        mz_values = self.h5["mz_values"]
+        file_space = mz_values.id.get_space()
+        file_space.select_none()
+        for start, stop in zip(block_starts.tolist(), block_stops.tolist()):
+            if stop > start:
+                file_space.select_hyperslab((start,), (stop - start,), op=h5s.SELECT_OR)
+        total = int((block_stops - block_starts).sum())
+        mz = np.empty(total, dtype=np.float32)
+        intensity = np.empty(total, dtype=np.float32)
+        if total:
+            mem_space = h5s.create_simple((total,))
+            mz_values.id.read(mem_space, file_space, mz)
+            self.h5["intensity_values"].id.read(mem_space, file_space, intensity)
+
+        bounds = list(zip(positions.tolist(), (positions + counts).tolist()))
+        return [mz[lo:hi] for lo, hi in bounds], [intensity[lo:hi] for lo, hi in bounds]
+
+    def get_spectrum_batch_by_rowids(self, rowids: Union[Sequence[int], np.ndarray], *, already_sorted: bool = False) -> List[dict]:
+        rowids = np.asarray(rowids, dtype=np.int64)
+        if not already_sorted:
+            rowids = np.sort(rowids)
+        if rowids.size == 0:
+            return []
+        if rowids[0] < 0 or rowids[-1] >= len(self.offsets) - 1:
+            raise IndexError("spectrum index out of range")
+
+        self.conn.register("rowid_tbl", pa.table({"rowid": rowids}))
+        try:
+            rows = self.conn.execute(_BATCH_QUERY).fetchall()
+        finally:
+            self.conn.unregister("rowid_tbl")
 
-        spectra_data = self.h5["spectra"][rowids]
+        mz, intensity = self._read_peaks(rowids)
 
         result = [
             {
-                "id": row[0],
-                "precursor_mz": row[1],
-                "precursor_charge": row[2],
-                "retention_time": row[3],
-                "mz": spectra_data[i, 0],
-                "intensity": spectra_data[i, 1]
+                "id": row[1],
+                "precursor_mz": row[2],
+                "precursor_charge": row[3],
+                "retention_time": row[4],
+                "mz": mz[i],
+                "intensity": intensity[i]
             }
             for i, row in enumerate(rows)
         ]
@@ -109,70 +192,49 @@ class DuckDBHDF5SpectraDataset:
         rowids = [row[0] for row in results]
         return self.get_spectrum_batch_by_rowids(rowids)
 
-    def _load_chunk(self, start_rowid: int):
-        query = f"""
-            SELECT rowid, id, precursor_mz, precursor_charge, retention_time
-            FROM spectra
-            WHERE rowid BETWEEN {start_rowid} AND {start_rowid + self.chunk_size - 1}
-        """
-        rows = self.conn.execute(query).fetchall()
+    def _fetch_chunk(self, conn: duckdb.DuckDBPyConnection, start_rowid: int) -> List[dict]:
+        rows = conn.execute(_RANGE_QUERY, [start_rowid, start_rowid + self.chunk_size - 1]).fetchall()
 
-        indices = [row[0] for row in rows]
-        spectra_data = self.h5["spectra"][min(indices):max(indices) + 1]
+        mz, intensity = self._read_peaks(np.array([row[0] for row in rows], dtype=np.int64)) if rows else ([], [])
 
-        self.current_chunk = [
+        return [
             {
                 "id": row[1],
                 "precursor_mz": row[2],
                 "precursor_charge": row[3],
                 "retention_time": row[4],
-                "mz": spectra_data[i, 0],
-                "intensity": spectra_data[i, 1]
+                "mz": mz[i],
+                "intensity": intensity[i]
             }
             for i, row in enumerate(rows)
         ]
-        self.current_chunk_start = start_rowid
 
-    def _get_from_chunk(self, idx: int) -> dict:
-        chunk_start = (idx // self.chunk_size) * self.chunk_size
-        if not self.current_chunk or idx < self.current_chunk_start or idx >= self.current_chunk_start + len(self.current_chunk):
-            self._load_chunk(chunk_start)
-
-        return self.current_chunk[idx - self.current_chunk_start]
-
-    def __getitem__(self, idx: Union[int, slice, List[int]]) -> Union[dict, List[dict]]:
+    def __getitem__(self, idx: Union[int, slice, List[int], np.ndarray]) -> Union[dict, List[dict]]:
         if self.sequential_mode:
             if isinstance(idx, slice):
                 start = idx.start or 0
                 stop = min(idx.stop if idx.stop is not None else len(self), len(self))
                 step = idx.step or 1
                 return [self._get_from_chunk(i) for i in range(start, stop, step)]
-            elif isinstance(idx, list):
+            elif isinstance(idx, (list, np.ndarray)):
                 return [self._get_from_chunk(i) for i in idx]
             else:
                 return self._get_from_chunk(idx)
 
         if isinstance(idx, slice):
-            rowids = list(range(idx.start or 0, idx.stop or len(self), idx.step or 1))
-        elif isinstance(idx, list):
+            rowids = np.arange(*idx.indices(len(self)))
+            already_sorted = (idx.step or 1) > 0
+        elif isinstance(idx, (list, np.ndarray)):
             rowids = idx
+            already_sorted = False
         else:
             rowids = [idx]
+            already_sorted = True
 
-        result = self.get_spectrum_batch_by_rowids(rowids)
-        return result if isinstance(idx, (slice, list)) else result[0]
-
-    def __len__(self):
-        return self.conn.execute("SELECT COUNT(*) FROM spectra").fetchone()[0]
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_value, traceback):
-        self.close()
+        result = self.get_spectrum_batch_by_rowids(rowids, already_sorted=already_sorted)
+        return result if isinstance(idx, (slice, list, np.ndarray)) else result[0]
 
     def close(self):
-        if self.conn:
-            self.conn.close()
+        super().close()
         if self.h5:
             self.h5.close()
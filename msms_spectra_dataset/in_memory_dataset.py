@@ -1,53 +1,337 @@
-from typing import List, Callable, Union
-import io
+from typing import List, Callable, Dict, Optional, Union
+import ast
+import operator
+import os
+import warnings
 
-from pyteomics import mgf
+import numpy as np
+import pyarrow as pa
 from spectrum_utils.spectrum import MsmsSpectrum
-from msms_spectra_dataset.utils import parse_spectrum  # Import the utility function
+from msms_spectra_dataset.mgf_parser import parse_mgf_files
+from msms_spectra_dataset.utils import SpectraColumns, concatenate_columns
+
+try:
+    import numexpr
+except ImportError:  # numexpr is optional
+    numexpr = None
+
+
+_COMPARISONS = {
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+_BINARY_OPERATORS = {
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+
+def _evaluate_predicate(node: ast.AST, columns: Dict[str, np.ndarray]):
+    """
+    Recursively evaluate a parsed predicate expression over the given columns.
+    """
+    if isinstance(node, ast.Expression):
+        return _evaluate_predicate(node.body, columns)
+    if isinstance(node, ast.Name):
+        if node.id not in columns:
+            raise ValueError(f"Unknown column in query: {node.id}")
+        return columns[node.id]
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.Compare):
+        left = _evaluate_predicate(node.left, columns)
+        mask = None
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _evaluate_predicate(comparator, columns)
+            result = _COMPARISONS[type(op)](left, right)
+            mask = result if mask is None else mask & result
+            left = right
+        return mask
+    if isinstance(node, ast.BoolOp):
+        values = [_evaluate_predicate(value, columns) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return combine.reduce(values)
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        left = _evaluate_predicate(node.left, columns)
+        right = _evaluate_predicate(node.right, columns)
+        return _BINARY_OPERATORS[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp):
+        operand = _evaluate_predicate(node.operand, columns)
+        if isinstance(node.op, (ast.Not, ast.Invert)):
+            return np.logical_not(operand)
+        if isinstance(node.op, ast.USub):
+            return -operand
+    raise ValueError(f"Unsupported query expression: {ast.dump(node)}")
+
+
+class SpectraBatch:
+    """
+    A batch of spectra selected from an InMemoryMGFSpectraDataset.
+
+    The batch exposes the columnar arrays of the selected spectra directly (views into the
+    dataset's arrays for contiguous slices); MsmsSpectrum objects are only constructed when
+    the batch is indexed or iterated.
+    """
+
+    def __init__(self, columns: SpectraColumns):
+        self.columns = columns
+
+    @property
+    def titles(self) -> pa.LargeStringArray:
+        return self.columns.titles
+
+    @property
+    def precursor_mz(self) -> np.ndarray:
+        return self.columns.precursor_mz
+
+    @property
+    def precursor_charge(self) -> np.ndarray:
+        return self.columns.precursor_charge
+
+    @property
+    def retention_time(self) -> np.ndarray:
+        return self.columns.retention_time
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self.columns.offsets
+
+    @property
+    def mz_values(self) -> np.ndarray:
+        return self.columns.mz_values
+
+    @property
+    def intensity_values(self) -> np.ndarray:
+        return self.columns.intensity_values
+
+    def __getitem__(self, idx: int) -> MsmsSpectrum:
+        idx = operator.index(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("spectrum index out of range")
+        return self.columns.to_spectrum(idx)
+
+    def __iter__(self):
+        return (self.columns.to_spectrum(i) for i in range(len(self)))
+
+    def __len__(self):
+        return len(self.columns)
+
+
+_ZONE_SIZE = 4096
+
+# Comparison with the constant on the left, as seen from the column: `500 < precursor_mz` is `precursor_mz > 500`
+_MIRRORED_COMPARISONS = {
+    ast.Gt: ast.Lt,
+    ast.GtE: ast.LtE,
+    ast.Lt: ast.Gt,
+    ast.LtE: ast.GtE,
+    ast.Eq: ast.Eq,
+}
+
+
+def _build_zone_maps(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Compute the minimum and maximum of every column over consecutive zones of `_ZONE_SIZE` spectra.
+    NaN values are ignored; zones containing only NaN get NaN bounds and never match a comparison.
+
+    Returns:
+        Dict[str, np.ndarray]: For every column, an array of shape (2, n_zones) with the zone minima and maxima.
+    """
+    zone_maps = {}
+    for name, values in columns.items():
+        if len(values) == 0:
+            continue
+        starts = np.arange(0, len(values), _ZONE_SIZE)
+        zone_maps[name] = np.stack([np.fmin.reduceat(values, starts), np.fmax.reduceat(values, starts)])
+    return zone_maps
+
+
+def _candidate_zones(node: ast.AST, zone_maps: Dict[str, np.ndarray]) -> Optional[np.ndarray]:
+    """
+    Determine the zones that can contain spectra matching a parsed predicate expression.
+
+    Only comparisons between a column and a numeric constant, combined with and/or, are used;
+    for anything else all zones are candidates.
+
+    Returns:
+        Optional[np.ndarray]: Boolean mask of the candidate zones, or None if every zone is a candidate.
+    """
+    if isinstance(node, ast.Expression):
+        return _candidate_zones(node.body, zone_maps)
+    if isinstance(node, ast.Compare):
+        candidates = None
+        left = node.left
+        for op, comparator in zip(node.ops, node.comparators):
+            op, right = type(op), comparator
+            if isinstance(right, ast.Name) and isinstance(left, ast.Constant):
+                left, right, op = right, left, _MIRRORED_COMPARISONS.get(op)
+            if (isinstance(left, ast.Name) and left.id in zone_maps and op in _MIRRORED_COMPARISONS
+                    and isinstance(right, ast.Constant) and isinstance(right.value, (int, float))):
+                zone_min, zone_max = zone_maps[left.id]
+                value = right.value
+                if op in (ast.Gt, ast.GtE):
+                    pair = _COMPARISONS[op](zone_max, value)
+                elif op in (ast.Lt, ast.LtE):
+                    pair = _COMPARISONS[op](zone_min, value)
+                else:
+                    pair = (zone_min <= value) & (zone_max >= value)
+                candidates = pair if candidates is None else candidates & pair
+            # The next comparison of a chain starts at this comparator, even if the operands were swapped
+            left = comparator
+        return candidates
+    is_and = isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And) or (
+        isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd))
+    is_or = isinstance(node, ast.BoolOp) and isinstance(node.op, ast.Or) or (
+        isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr))
+    if is_and or is_or:
+        operands = node.values if isinstance(node, ast.BoolOp) else [node.left, node.right]
+        masks = [_candidate_zones(operand, zone_maps) for operand in operands]
+        if is_and:
+            masks = [mask for mask in masks if mask is not None]
+            return np.logical_and.reduce(masks) if masks else None
+        if any(mask is None for mask in masks):
+            return None
+        return np.logical_or.reduce(masks)
+    return None
+
+
+def _is_numexpr_compatible(tree: ast.AST, columns: Dict[str, np.ndarray]) -> bool:
+    """
+    Check whether a parsed expression only uses constructs that numexpr evaluates like NumPy.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Compare) and len(node.ops) > 1:
+            return False  # numexpr does not support chained comparisons
+        if isinstance(node, ast.Name):
+            if node.id not in columns:
+                return False
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)):
+                return False
+        elif isinstance(node, ast.UnaryOp):
+            if not isinstance(node.op, (ast.Invert, ast.USub)):
+                return False
+        elif not isinstance(node, (ast.Expression, ast.Compare, ast.BinOp, ast.Load, *_COMPARISONS, *_BINARY_OPERATORS)):
+            return False
+    return True
 
 
 class InMemoryMGFSpectraDataset:
-    def __init__(self, mgf_files: List[str]):
+    def __init__(self, mgf_files: List[str], num_workers: Optional[int] = None, cache: bool = False):
         """
         Create a dataset from a list of MGF files.
-        Each spectrum is parsed into a MsmsSpectrum object and stored in memory.
+        All spectra are parsed into columnar NumPy arrays and stored in memory;
+        MsmsSpectrum objects are only constructed when a spectrum is accessed.
+
+        Args:
+            mgf_files (List[str]): List of MGF files to load spectra from.
+            num_workers (int, optional): Number of processes used to parse the files in parallel.
+                Defaults to the number of CPUs; 1 parses all files in the current process.
+            cache (bool): If True, cache the parsed spectra of every MGF file in an Arrow IPC file
+                next to it (`<file>.arrow`). Subsequent loads memory-map the cache instead of
+                reparsing, as long as the MGF file's size and modification time are unchanged.
         """
         self.mgf_files = mgf_files
-        self.spectra: List[MsmsSpectrum] = []
-        self._load_spectra()
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.cache = cache
+        self.columns: SpectraColumns = self._load_spectra()
+        self._zone_maps = _build_zone_maps(self.columns.scalar_columns())
 
-    def _sanitize_mgf(self, file):
+    def _load_spectra(self) -> SpectraColumns:
         """
-        Preprocess the MGF file content to sanitize invalid CHARGE values.
+        Parse each provided MGF file and store all spectra as columnar arrays.
+        Multiple files are parsed in parallel worker processes, and files that are
+        listed several times are only parsed once.
         """
-        sanitized_lines = []
-        with open(file, 'r') as f:
-            for line in f:
-                if line.startswith("CHARGE="):
-                    charge = line.split("=", 1)[1].strip()
-                    if not (charge.endswith(("+", "-")) and charge[:-1].isdigit()):
-                        line = "CHARGE=0\n"  # Replace invalid CHARGE with a default value
-                sanitized_lines.append(line)
-        
-        sanitized_content = io.StringIO("".join(sanitized_lines))
-        return mgf.MGF(sanitized_content, convert_arrays=0)
+        parsed_by_file = parse_mgf_files(self.mgf_files, self.num_workers, self.cache)
+        return concatenate_columns([parsed_by_file[file] for file in self.mgf_files])
 
-    def _load_spectra(self):
+    def __getitem__(self, idx: Union[int, slice, List[int], np.ndarray]) -> Union[MsmsSpectrum, "SpectraBatch"]:
         """
-        Parse each provided MGF file and store all spectra in a list.
+        Retrieve spectra by index, slice, or list of indices.
+
+        Args:
+            idx (Union[int, slice, List[int], np.ndarray]): Index, slice, or list of indices of spectra to retrieve.
+
+        Returns:
+            Union[MsmsSpectrum, SpectraBatch]: The spectrum for an index, or a batch view of the
+                selected spectra for a slice or list of indices.
         """
-        for file in self.mgf_files:
-            for spec in self._sanitize_mgf(file):
-                self.spectra.append(parse_spectrum(spec))
+        if isinstance(idx, (slice, list, np.ndarray)):
+            return SpectraBatch(self.columns.take(idx))
+        idx = operator.index(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("spectrum index out of range")
+        return self.columns.to_spectrum(idx)
 
-    def __getitem__(self, idx: Union[int, slice]) -> Union[MsmsSpectrum, List[MsmsSpectrum]]:
-        return self.spectra[idx]
+    def __iter__(self):
+        return (self.columns.to_spectrum(i) for i in range(len(self)))
 
     def __len__(self):
-        return len(self.spectra)
+        return len(self.columns)
+
+    def query(self, filter_query: Union[str, Callable[[MsmsSpectrum], bool]]) -> Union[np.ndarray, List[MsmsSpectrum]]:
+        """
+        Query spectra either with a vectorized expression or a user-defined filter function.
 
-    def query(self, filter_func: Callable[[MsmsSpectrum], bool]) -> List[MsmsSpectrum]:
+        Args:
+            filter_query (Union[str, Callable[[MsmsSpectrum], bool]]): Either an expression as
+                accepted by `query_expr`, or a filter function that is called with every spectrum.
+                Filter functions are deprecated, as every spectrum has to be materialized.
+
+        Returns:
+            Union[np.ndarray, List[MsmsSpectrum]]: The indices of the matching spectra for an
+                expression, or the list of matching spectra for a filter function.
+        """
+        if callable(filter_query):
+            warnings.warn(
+                "Querying with a filter function is deprecated, use an expression with query_expr instead.",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+            return [spec for spec in self if filter_query(spec)]
+        return self.query_expr(filter_query)
+
+    def query_expr(self, expr: str) -> np.ndarray:
         """
-        Return a list of spectra matching a user-defined filter function.
+        Query spectra with a vectorized expression over the per-spectrum columns.
+
+        Args:
+            expr (str): Expression over the columns `precursor_mz`, `precursor_intensity`,
+                `precursor_charge` and `retention_time`, e.g. "precursor_mz > 500" or
+                "(precursor_charge == 2) & (retention_time < 600)". `and`, `or` and `not`
+                are supported as well. Evaluated with numexpr if it is installed.
+                Comparisons of a column with a constant are first checked against the minimum
+                and maximum of every zone of 4096 spectra, and zones that cannot match are skipped.
+
+        Returns:
+            np.ndarray: The indices of the matching spectra.
         """
-        return [spec for spec in self.spectra if filter_func(spec)]
+        tree = ast.parse(expr, mode="eval")
+        columns = self.columns.scalar_columns()
+        rows = None
+        zones = _candidate_zones(tree, self._zone_maps)
+        if zones is not None and not zones.all():
+            rows = (np.flatnonzero(zones)[:, None] * _ZONE_SIZE + np.arange(_ZONE_SIZE)).ravel()
+            rows = rows[rows < len(self)]
+            columns = {name: values[rows] for name, values in columns.items()}
+        if numexpr is not None and _is_numexpr_compatible(tree, columns):
+            mask = numexpr.evaluate(expr, local_dict=columns, global_dict={})
+        else:
+            mask = _evaluate_predicate(tree, columns)
+        n_rows = len(self) if rows is None else len(rows)
+        matches = np.flatnonzero(np.broadcast_to(mask, (n_rows,)))
+        return matches if rows is None else rows[matches]
@@ -0,0 +1,541 @@
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+from numba import njit
+
+from msms_spectra_dataset.utils import SpectraColumns
+
+# Bump when the layout of the cached Arrow files changes
+_CACHE_VERSION = b"1"
+
+# Powers of ten that are exactly representable as float64
+_POWERS_OF_TEN = np.array([10.0 ** k for k in range(23)])
+_MAX_EXACT_MANTISSA = 1 << 53
+# Digits beyond the 18th do not fit in an int64 mantissa and are dropped
+_MAX_MANTISSA_DIGITS = 18
+# Exponents that no decimal number reaches, used to mark "nan" and "inf"
+_NAN_EXPONENT = 1 << 40
+_INF_EXPONENT = (1 << 40) + 1
+
+# Patterns of the regular expression parser for single spectra
+_HEADER_LINE_RE = re.compile(rb"^[ \t]*([A-Za-z][A-Za-z0-9_]*)=(.*?)[ \t]*\r?$", re.M)
+_PEAKS_START_RE = re.compile(rb"^[ \t]*[-+.0-9]", re.M)
+# Only "<digits><sign>" charges are valid; anything else is treated as a missing charge (0),
+# like in the Numba parser
+_CHARGE_VALUE_RE = re.compile(rb"[ \t]*([0-9]+)([+-])")
+_EXTRA_COLUMNS_RE = re.compile(rb"^([ \t]*\S+[ \t]+\S+)[^\r\n]*", re.M)
+
+_BEGIN_IONS = np.frombuffer(b"BEGIN IONS", dtype=np.uint8)
+_END_IONS = np.frombuffer(b"END IONS", dtype=np.uint8)
+_TITLE = np.frombuffer(b"TITLE", dtype=np.uint8)
+_PEPMASS = np.frombuffer(b"PEPMASS", dtype=np.uint8)
+_CHARGE = np.frombuffer(b"CHARGE", dtype=np.uint8)
+_RTINSECONDS = np.frombuffer(b"RTINSECONDS", dtype=np.uint8)
+_NAN = np.frombuffer(b"NAN", dtype=np.uint8)
+_INF = np.frombuffer(b"INF", dtype=np.uint8)
+_INFINITY = np.frombuffer(b"INFINITY", dtype=np.uint8)
+
+
+@njit(cache=True)
+def _is_space(c):
+    return c == 32 or c == 9 or c == 13
+
+
+@njit(cache=True)
+def _is_digit(c):
+    return 48 <= c <= 57
+
+
+@njit(cache=True)
+def _matches(buf, start, end, pattern):
+    """
+    Check whether buf[start:end] equals the (uppercase) pattern, ignoring case.
+    """
+    if end - start != len(pattern):
+        return False
+    for k in range(len(pattern)):
+        c = buf[start + k]
+        if 97 <= c <= 122:
+            c -= 32
+        if c != pattern[k]:
+            return False
+    return True
+
+
+@njit(cache=True)
+def _parse_decimal(buf, pos, end):
+    """
+    Scan a decimal number starting at buf[pos] into an integer mantissa and a decimal exponent.
+    "nan" and "inf" (or "infinity"), in any case, are returned with `_NAN_EXPONENT` or `_INF_EXPONENT`.
+
+    Returns:
+        Tuple[bool, int, int, int, bool]: The sign, the mantissa, the exponent, the position
+            after the number and whether parsing succeeded.
+    """
+    negative = False
+    if pos < end and (buf[pos] == 45 or buf[pos] == 43):  # '-' or '+'
+        negative = buf[pos] == 45
+        pos += 1
+    mantissa = 0
+    n_significant = 0
+    exponent = 0
+    n_digits = 0
+    while pos < end and _is_digit(buf[pos]):
+        if n_significant < _MAX_MANTISSA_DIGITS:
+            mantissa = mantissa * 10 + (buf[pos] - 48)
+            if mantissa != 0:
+                n_significant += 1
+        else:
+            exponent += 1
+        n_digits += 1
+        pos += 1
+    if pos < end and buf[pos] == 46:  # '.'
+        pos += 1
+        while pos < end and _is_digit(buf[pos]):
+            if n_significant < _MAX_MANTISSA_DIGITS:
+                mantissa = mantissa * 10 + (buf[pos] - 48)
+                if mantissa != 0:
+                    n_significant += 1
+                exponent -= 1
+            n_digits += 1
+            pos += 1
+    if n_digits == 0:
+        if _matches(buf, pos, min(pos + 8, end), _INFINITY):
+            return negative, 1, _INF_EXPONENT, pos + 8, True
+        if _matches(buf, pos, min(pos + 3, end), _INF):
+            return negative, 1, _INF_EXPONENT, pos + 3, True
+        if _matches(buf, pos, min(pos + 3, end), _NAN):
+            return negative, 1, _NAN_EXPONENT, pos + 3, True
+        return negative, 0, 0, pos, False
+    if pos < end and (buf[pos] == 101 or buf[pos] == 69):  # 'e' or 'E'
+        exp_pos = pos + 1
+        exp_negative = False
+        if exp_pos < end and (buf[exp_pos] == 45 or buf[exp_pos] == 43):
+            exp_negative = buf[exp_pos] == 45
+            exp_pos += 1
+        if exp_pos < end and _is_digit(buf[exp_pos]):
+            explicit_exponent = 0
+            while exp_pos < end and _is_digit(buf[exp_pos]):
+                if explicit_exponent < 100000:
+                    explicit_exponent = explicit_exponent * 10 + (buf[exp_pos] - 48)
+                exp_pos += 1
+            exponent += -explicit_exponent if exp_negative else explicit_exponent
+            pos = exp_pos
+    return negative, mantissa, exponent, pos, True
+
+
+@njit(cache=True)
+def _to_double(negative, mantissa, exponent):
+    """
+    Convert a mantissa and decimal exponent to a float.
+
+    When the mantissa fits in 53 bits and the power of ten is exactly representable
+    (Clinger's fast path, which covers virtually all m/z and intensity values), the result
+    is a single correctly rounded multiplication or division.
+    """
+    if mantissa <= _MAX_EXACT_MANTISSA and -22 <= exponent <= 22:
+        value = float(mantissa)
+        if exponent >= 0:
+            value *= _POWERS_OF_TEN[exponent]
+        else:
+            value /= _POWERS_OF_TEN[-exponent]
+    elif mantissa == 0:
+        value = 0.0
+    elif exponent == _NAN_EXPONENT:
+        value = np.nan
+    elif exponent == _INF_EXPONENT:
+        value = np.inf
+    else:
+        value = float(mantissa) * 10.0 ** exponent
+    return -value if negative else value
+
+
+@njit(cache=True)
+def _parse_double(buf, pos, end):
+    """
+    Parse a floating point number starting at buf[pos].
+
+    Returns:
+        Tuple[float, int, bool]: The value, the position after the number and whether parsing succeeded.
+    """
+    negative, mantissa, exponent, pos, ok = _parse_decimal(buf, pos, end)
+    return _to_double(negative, mantissa, exponent), pos, ok
+
+
+@njit(cache=True)
+def _parse_charge(buf, pos, end):
+    """
+    Parse a charge of the form "<digits><sign>", e.g. "2+"; anything else is parsed as 0.
+    """
+    charge = 0
+    n_digits = 0
+    while pos < end and _is_digit(buf[pos]):
+        charge = charge * 10 + (buf[pos] - 48)
+        n_digits += 1
+        pos += 1
+    if n_digits == 0 or pos != end - 1 or charge > 127:
+        return 0
+    if buf[pos] == 43:  # '+'
+        return charge
+    if buf[pos] == 45:  # '-'
+        return -charge
+    return 0
+
+
+@njit(cache=True)
+def _parse_mgf(buf, fill, titles_data, title_offsets, precursor_mz, precursor_intensity,
+               precursor_charge, retention_time, offsets, mz_values, intensity_values):
+    """
+    Scan an MGF file buffer and, if `fill` is True, write the spectra into the preallocated arrays.
+
+    The first pass (`fill=False`) only counts spectra, peaks and title bytes so that the output
+    arrays can be allocated with their exact sizes; the second pass fills them.
+
+    Returns:
+        Tuple[int, int, int]: The number of spectra, peaks and title bytes.
+    """
+    n = len(buf)
+    n_spectra = 0
+    n_peaks = 0
+    n_title_bytes = 0
+    in_ions = False
+    spectrum_peaks = 0
+    title_start = 0
+    title_end = 0
+    spectrum_mz = 0.0
+    spectrum_intensity = np.nan
+    spectrum_charge = 0
+    spectrum_rt = np.nan
+
+    i = 0
+    while i < n:
+        start = i
+        while i < n and buf[i] != 10:  # '\n'
+            i += 1
+        end = i
+        i += 1
+        while start < end and _is_space(buf[start]):
+            start += 1
+        while end > start and _is_space(buf[end - 1]):
+            end -= 1
+        if start == end:
+            continue
+
+        if _matches(buf, start, end, _BEGIN_IONS):
+            in_ions = True
+            spectrum_peaks = 0
+            title_start = 0
+            title_end = 0
+            spectrum_mz = 0.0
+            spectrum_intensity = np.nan
+            spectrum_charge = 0
+            spectrum_rt = np.nan
+            continue
+        if not in_ions:
+            continue
+        if _matches(buf, start, end, _END_IONS):
+            in_ions = False
+            if fill:
+                precursor_mz[n_spectra] = spectrum_mz
+                precursor_intensity[n_spectra] = spectrum_intensity
+                precursor_charge[n_spectra] = spectrum_charge
+                retention_time[n_spectra] = spectrum_rt
+                for k in range(title_start, title_end):
+                    titles_data[n_title_bytes + k - title_start] = buf[k]
+                title_offsets[n_spectra + 1] = n_title_bytes + title_end - title_start
+                offsets[n_spectra + 1] = n_peaks + spectrum_peaks
+            n_spectra += 1
+            n_peaks += spectrum_peaks
+            n_title_bytes += title_end - title_start
+            continue
+
+        c = buf[start]
+        if _is_digit(c) or c == 45 or c == 43 or c == 46:
+            # Only scan the numbers in the counting pass; the float conversion is done when filling
+            mz_negative, mz_mantissa, mz_exponent, pos, ok = _parse_decimal(buf, start, end)
+            while pos < end and _is_space(buf[pos]):
+                pos += 1
+            intensity_negative, intensity_mantissa, intensity_exponent, pos, ok_intensity = _parse_decimal(buf, pos, end)
+            if ok and ok_intensity:
+                peak = n_peaks + spectrum_peaks
+                if fill and peak < len(mz_values):
+                    mz_values[peak] = _to_double(mz_negative, mz_mantissa, mz_exponent)
+                    intensity_values[peak] = _to_double(intensity_negative, intensity_mantissa, intensity_exponent)
+                spectrum_peaks += 1
+            continue
+
+        eq = start
+        while eq < end and buf[eq] != 61:  # '='
+            eq += 1
+        if eq == end:
+            continue
+        value_start = eq + 1
+        while value_start < end and _is_space(buf[value_start]):
+            value_start += 1
+        if _matches(buf, start, eq, _TITLE):
+            title_start = value_start
+            title_end = end
+        elif _matches(buf, start, eq, _PEPMASS):
+            value, pos, ok = _parse_double(buf, value_start, end)
+            spectrum_mz = value if ok else 0.0
+            while pos < end and _is_space(buf[pos]):
+                pos += 1
+            value, pos, ok = _parse_double(buf, pos, end)
+            spectrum_intensity = value if ok else np.nan
+        elif _matches(buf, start, eq, _CHARGE):
+            spectrum_charge = _parse_charge(buf, value_start, end)
+        elif _matches(buf, start, eq, _RTINSECONDS):
+            value, pos, ok = _parse_double(buf, value_start, end)
+            spectrum_rt = value if ok else np.nan
+
+    return n_spectra, n_peaks, n_title_bytes
+
+
+def _parse_buffer(buf: np.ndarray) -> SpectraColumns:
+    """
+    Parse the spectra contained in an MGF file buffer into columnar arrays.
+    """
+    empty_u8, empty_i64 = np.empty(0, np.uint8), np.empty(0, np.int64)
+    empty_f32, empty_i8 = np.empty(0, np.float32), np.empty(0, np.int8)
+    n_spectra, n_peaks, n_title_bytes = _parse_mgf(
+        buf, False, empty_u8, empty_i64, empty_f32, empty_f32,
+        empty_i8, empty_f32, empty_i64, empty_f32, empty_f32,
+    )
+
+    titles_data = np.empty(n_title_bytes, np.uint8)
+    title_offsets = np.zeros(n_spectra + 1, np.int64)
+    columns = SpectraColumns(
+        titles=None,
+        precursor_mz=np.empty(n_spectra, np.float32),
+        precursor_intensity=np.empty(n_spectra, np.float32),
+        precursor_charge=np.empty(n_spectra, np.int8),
+        retention_time=np.empty(n_spectra, np.float32),
+        offsets=np.zeros(n_spectra + 1, np.int64),
+        mz_values=np.empty(n_peaks, np.float32),
+        intensity_values=np.empty(n_peaks, np.float32),
+    )
+    _parse_mgf(
+        buf, True, titles_data, title_offsets, columns.precursor_mz, columns.precursor_intensity,
+        columns.precursor_charge, columns.retention_time, columns.offsets,
+        columns.mz_values, columns.intensity_values,
+    )
+    columns.titles = pa.LargeStringArray.from_buffers(
+        n_spectra, pa.py_buffer(title_offsets), pa.py_buffer(titles_data)
+    )
+    columns.titles.validate(full=True)
+    return columns
+
+
+def _cache_path(file: str) -> str:
+    return file + ".arrow"
+
+
+def _fingerprint(file: str) -> Dict[bytes, bytes]:
+    stat = os.stat(file)
+    return {
+        b"cache_version": _CACHE_VERSION,
+        b"mgf_size": str(stat.st_size).encode(),
+        b"mgf_mtime_ns": str(stat.st_mtime_ns).encode(),
+    }
+
+
+def _read_cache(file: str) -> Optional[SpectraColumns]:
+    """
+    Memory-map the cached columns of an MGF file if the cache matches the file's size and mtime.
+    """
+    path = _cache_path(file)
+    if not os.path.exists(path):
+        return None
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+        metadata = reader.schema.metadata or {}
+        if any(metadata.get(key) != value for key, value in _fingerprint(file).items()):
+            return None
+        return SpectraColumns.from_arrow(reader.read_all())
+    except (pa.ArrowInvalid, OSError):
+        return None
+
+
+def _write_cache(file: str, columns: SpectraColumns):
+    """
+    Store the parsed columns of an MGF file in an Arrow IPC file next to it.
+    Failing to write the cache (e.g. in a read-only directory) is not an error.
+    """
+    path = _cache_path(file)
+    table = columns.to_arrow()
+    table = table.replace_schema_metadata(_fingerprint(file))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _parse_and_cache(file: str, cache: bool) -> SpectraColumns:
+    """
+    Parse an MGF file and, if requested, store the result in its cache file.
+    """
+    columns = _parse_file(file)
+    if cache:
+        _write_cache(file, columns)
+    return columns
+
+
+def parse_mgf_file(file: str, cache: bool = False) -> SpectraColumns:
+    """
+    Parse all spectra in an MGF file into columnar arrays.
+
+    Args:
+        file (str): Path to the MGF file.
+        cache (bool): If True, reuse (or create) an Arrow IPC cache file `<file>.arrow` next to the
+            MGF file. A valid cache is memory-mapped instead of reparsing the MGF file.
+
+    Returns:
+        SpectraColumns: The parsed spectra.
+    """
+    if cache:
+        columns = _read_cache(file)
+        if columns is not None:
+            return columns
+    return _parse_and_cache(file, cache)
+
+
+def parse_mgf_files(files: List[str], num_workers: Optional[int] = None, cache: bool = False) -> Dict[str, SpectraColumns]:
+    """
+    Parse several MGF files into columnar arrays. The files are parsed in parallel worker
+    processes, and files that are listed several times are only parsed once.
+
+    Args:
+        files (List[str]): Paths to the MGF files.
+        num_workers (int, optional): Number of worker processes. Defaults to the number of CPUs;
+            1 parses all files in the current process.
+        cache (bool): If True, use an Arrow IPC cache file next to every MGF file (see `parse_mgf_file`).
+
+    Returns:
+        Dict[str, SpectraColumns]: The parsed spectra of every unique file, in order of first occurrence.
+    """
+    unique_files = list(dict.fromkeys(files))
+    # Valid caches are memory-mapped here: sending them back from a worker would copy every array
+    parsed = {file: _read_cache(file) for file in unique_files} if cache else dict.fromkeys(unique_files)
+    misses = [file for file, columns in parsed.items() if columns is None]
+    parse = partial(_parse_and_cache, cache=cache)
+    num_workers = min(num_workers or os.cpu_count() or 1, len(misses))
+    if num_workers <= 1:
+        parsed.update((file, parse(file)) for file in misses)
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            parsed.update(zip(misses, executor.map(parse, misses)))
+    return parsed
+
+
+def parse_mgf_block(block: bytes) -> Dict[str, Any]:
+    """
+    Parse a single `BEGIN IONS ... END IONS` block with regular expressions and NumPy.
+
+    The header lines are matched with one precompiled regular expression and all peaks are
+    converted with a single `np.fromstring` call, without a Python object per peak.
+
+    Args:
+        block (bytes): The spectrum, from its BEGIN IONS line up to (and optionally including) END IONS.
+
+    Returns:
+        Dict[str, Any]: The spectrum in the layout produced by pyteomics, with a "params"
+            dictionary and "m/z array" / "intensity array" entries, as accepted by `parse_spectrum`.
+    """
+    begin = block.find(b"BEGIN IONS")
+    start = block.find(b"\n", begin) + 1 if begin != -1 else 0
+    end = block.find(b"END IONS", start)
+    body = block[start:] if end == -1 else block[start:end]
+
+    peaks_start = _PEAKS_START_RE.search(body)
+    header = body if peaks_start is None else body[:peaks_start.start()]
+    params: Dict[str, Any] = {}
+    for key, value in _HEADER_LINE_RE.findall(header):
+        key = key.decode("ascii").lower()
+        if key == "title":
+            params["title"] = value.decode("utf-8", errors="replace")
+        elif key == "pepmass":
+            try:
+                values = [float(v) for v in value.split()[:2]]
+            except ValueError:
+                values = []
+            if values:
+                params["pepmass"] = (values[0], values[1] if len(values) > 1 else None)
+        elif key == "charge":
+            charge = _CHARGE_VALUE_RE.fullmatch(value)
+            if charge is not None and int(charge.group(1)) <= 127:
+                params["charge"] = -int(charge.group(1)) if charge.group(2) == b"-" else int(charge.group(1))
+        elif key == "rtinseconds":
+            try:
+                params["rtinseconds"] = float(value)
+            except ValueError:
+                pass
+        else:
+            params[key] = value.decode("utf-8", errors="replace")
+
+    if peaks_start is None:
+        peaks = np.empty((0, 2), dtype=np.float32)
+    else:
+        peaks_data = body[peaks_start.start():]
+        peaks = None
+        if len(peaks_data.split(b"\n", 1)[0].split()) == 2:
+            try:
+                peaks = np.fromstring(peaks_data, dtype=np.float32, sep=" ")
+            except (ValueError, DeprecationWarning):
+                # Non-numeric extra columns on a later line (e.g. "1+" annotations) stop the conversion:
+                # NumPy >= 2.3 raises, older versions warn and return the values read so far, which the
+                # count below rejects
+                peaks = np.empty(0, dtype=np.float32)
+            # Every line must contribute exactly one pair; otherwise extra columns on a later line
+            # would be read as peaks. Blank lines also take the slower path below, which is still correct.
+            n_lines = peaks_data.count(b"\n") + (not peaks_data.endswith(b"\n"))
+            peaks = peaks.reshape(-1, 2) if len(peaks) == 2 * n_lines else None
+        if peaks is None:
+            # Peak lines with additional columns (e.g. fragment charges): keep m/z and intensity only
+            peaks_data = _EXTRA_COLUMNS_RE.sub(rb"\1", peaks_data)
+            peaks = np.fromstring(peaks_data, dtype=np.float32, sep=" ").reshape(-1, 2)
+    return {
+        "params": params,
+        "m/z array": np.ascontiguousarray(peaks[:, 0]),
+        "intensity array": np.ascontiguousarray(peaks[:, 1]),
+    }
+
+
+def _advise_sequential(fd: int, mm: mmap.mmap):
+    """
+    Tell the kernel that the file is read sequentially, so that it reads ahead more aggressively
+    on cold loads. The hints are only available on some platforms and are best effort.
+    """
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+    except OSError:
+        pass
+
+
+def _parse_file(file: str) -> SpectraColumns:
+    """
+    Parse all spectra in an MGF file into columnar arrays.
+    """
+    with open(file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return SpectraColumns.empty()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _advise_sequential(f.fileno(), mm)
+            buf = np.frombuffer(mm, dtype=np.uint8)
+            try:
+                return _parse_buffer(buf)
+            finally:
+                # Release the buffer export so that the mmap can be closed
+                del buf
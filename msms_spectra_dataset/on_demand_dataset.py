@@ -1,55 +1,90 @@
-from typing import List, Union, Tuple
-from pyteomics import mgf
-from msms_spectra_dataset.utils import parse_spectrum
-import io
+import mmap
+import os
+from typing import Dict, List, Optional, Union
+from msms_spectra_dataset.mgf_parser import parse_mgf_block
+from msms_spectra_dataset.utils import GrowBuf, parse_spectrum
+import numpy as np
 
 
 class OnDemandMGFSpectraDataset:
     def __init__(self, mgf_files: List[str]):
         """
         Create a dataset from a list of MGF files.
-        Instead of loading all spectra into memory, store file paths and line offsets.
+        Instead of loading all spectra into memory, store the file and byte offset of every spectrum.
         """
         self.mgf_files = mgf_files
-        self.index: List[Tuple[str, int]] = []  # List of (file_path, line_offset)
+        self.file_ids: np.ndarray = np.empty(0, np.int32)  # Index into mgf_files of every spectrum
+        self.offsets: np.ndarray = np.empty(0, np.int64)  # Byte offset of every spectrum in its file
+        self._mmaps: Dict[str, Optional[mmap.mmap]] = {}  # Read-only memory map of every opened file
         self._build_index()
 
+    def _mmap(self, file: str) -> Optional[mmap.mmap]:
+        """
+        Get the memory map of a file, mapping it on first use. Empty files cannot be mapped and give None.
+        """
+        if file not in self._mmaps:
+            with open(file, 'rb') as f:
+                self._mmaps[file] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+        return self._mmaps[file]
+
     def _build_index(self):
         """
-        Build an index of spectra by storing the file path and starting byte offset for each spectrum.
+        Build an index of spectra by storing the file and starting byte offset for each spectrum.
+        Files that are listed several times are only scanned once.
         """
-        for file in self.mgf_files:
-            with open(file, 'r') as f:
-                content = f.read()  # Read the entire file into memory
-                offset = 0
-                while True:
-                    begin_idx = content.find("BEGIN IONS", offset)
-                    if begin_idx == -1:
-                        break
-                    self.index.append((file, begin_idx))
-                    offset = begin_idx + len("BEGIN IONS")
+        file_ids = GrowBuf(np.int32)
+        offsets = GrowBuf(np.int64)
+        offsets_by_file: Dict[str, np.ndarray] = {}
+        for file_id, file in enumerate(self.mgf_files):
+            if file not in offsets_by_file:
+                # Search the mapped bytes, without reading or decoding the whole file
+                mm = self._mmap(file)
+                file_offsets = []
+                offset = mm.find(b"BEGIN IONS") if mm is not None else -1
+                while offset != -1:
+                    file_offsets.append(offset)
+                    offset = mm.find(b"BEGIN IONS", offset + len(b"BEGIN IONS"))
+                offsets_by_file[file] = np.array(file_offsets, dtype=np.int64)
+            file_offsets = offsets_by_file[file]
+            offsets.append(file_offsets)
+            file_ids.append(np.full(len(file_offsets), file_id, dtype=np.int32))
+        self.file_ids = file_ids.finalize()
+        self.offsets = offsets.finalize()
 
     def _load_spectrum(self, file: str, offset: int):
         """
         Load a single spectrum from the specified file and byte offset.
+        The block is sliced from the cached memory map, without reopening the file.
         """
-        with open(file, 'r') as f:
-            f.seek(offset)
-            lines = []
-            for line in f:
-                lines.append(line)
-                if line.startswith("END IONS"):
-                    break
-        spectrum_data = "\n".join(lines)
-        spectrum_stream = io.StringIO(spectrum_data)
-        parsed = next(mgf.read(spectrum_stream, convert_arrays=1, use_index=False))
-        return parse_spectrum(parsed)
+        mm = self._mmap(file)
+        end = mm.find(b"END IONS", offset)
+        return parse_spectrum(parse_mgf_block(mm[offset:] if end == -1 else mm[offset:end]))
 
     def __getitem__(self, idx: Union[int, slice]):
         if isinstance(idx, slice):
-            return [self._load_spectrum(file, offset) for file, offset in self.index[idx]]
-        file, offset = self.index[idx]
-        return self._load_spectrum(file, offset)
+            return [self[i] for i in range(len(self))[idx]]
+        return self._load_spectrum(self.mgf_files[self.file_ids[idx]], int(self.offsets[idx]))
 
     def __len__(self):
-        return len(self.index)
+        return len(self.offsets)
+
+    def __getstate__(self):
+        # Memory maps cannot be pickled (e.g. for DataLoader workers); they are reopened on use
+        state = self.__dict__.copy()
+        state["_mmaps"] = {}
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the memory maps of the files.
+        """
+        for mm in self._mmaps.values():
+            if mm is not None:
+                mm.close()
+        self._mmaps.clear()
@@ -0,0 +1,158 @@
+import abc
+import operator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import duckdb
+
+# The SQL text of the queries on the hot path is constant: chunk bounds are bound as parameters,
+# and batches join with a registered "rowid_tbl" table instead of listing the row IDs
+COUNT_QUERY = "SELECT COUNT(*) FROM spectra"
+
+
+def range_query(columns: List[str]) -> str:
+    """
+    Build the query for the given columns of the spectra with row IDs between $1 and $2, preceded by the row ID.
+    """
+    return f"SELECT rowid, {', '.join(columns)} FROM spectra WHERE rowid BETWEEN $1 AND $2 ORDER BY rowid"
+
+
+def batch_query(columns: List[str]) -> str:
+    """
+    Build the query for the given columns of the spectra listed in "rowid_tbl", preceded by the row ID.
+    """
+    return (
+        f"SELECT s.rowid, {', '.join(f's.{column}' for column in columns)} "
+        "FROM rowid_tbl r JOIN spectra s ON s.rowid = r.rowid ORDER BY s.rowid"
+    )
+
+
+# Fraction of a chunk after which the next chunk is prefetched in sequential mode
+_PREFETCH_FRACTION = 0.8
+
+
+class SequentialChunksMixin(abc.ABC):
+    """
+    Chunked loading with background prefetching for the sequential mode of the DuckDB datasets.
+
+    The class using it provides `conn` (the DuckDB connection) and `chunk_size`, calls
+    `_init_chunks` in its constructor and implements `_fetch_chunk`.
+    """
+
+    def _init_chunks(self):
+        """
+        Initialize the state of the chunked loading.
+        """
+        self.current_chunk = []
+        self.current_chunk_start = 0
+        # Number of spectra, cached by __len__ and reset by ingest
+        self._n = None
+        # Background loading of the next chunk in sequential mode. The worker thread uses its own
+        # cursor, because a DuckDB connection must not be used from several threads at once.
+        self._prefetch_pool: Optional[ThreadPoolExecutor] = None
+        self._prefetch_conn: Optional[duckdb.DuckDBPyConnection] = None
+        self._next_chunk: Optional[Future] = None
+        self._next_chunk_start = -1
+
+    @abc.abstractmethod
+    def _fetch_chunk(self, conn: duckdb.DuckDBPyConnection, start_rowid: int) -> Sequence[dict]:
+        """
+        Fetch the chunk of spectra starting from the given row ID.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): The connection or cursor to query.
+            start_rowid (int): The starting row ID for the chunk, as a Python int.
+
+        Returns:
+            Sequence[dict]: The spectra of the chunk.
+        """
+
+    def _load_chunk(self, start_rowid: int):
+        """
+        Load a chunk of spectra into memory starting from the given row ID.
+        A matching prefetched chunk is used instead of querying again.
+
+        Args:
+            start_rowid (int): The starting row ID for the chunk.
+        """
+        next_chunk, self._next_chunk = self._next_chunk, None
+        if next_chunk is not None and self._next_chunk_start == start_rowid:
+            self.current_chunk = next_chunk.result()
+        else:
+            self.current_chunk = self._fetch_chunk(self.conn, start_rowid)
+        self.current_chunk_start = start_rowid
+
+    def _prefetch_chunk(self, start_rowid: int):
+        """
+        Start loading the chunk at the given row ID in a background thread.
+
+        Args:
+            start_rowid (int): The starting row ID for the chunk.
+        """
+        if self._prefetch_pool is None:
+            self._prefetch_pool = ThreadPoolExecutor(max_workers=1)
+            self._prefetch_conn = self.conn.cursor()
+        self._next_chunk = self._prefetch_pool.submit(self._fetch_chunk, self._prefetch_conn, start_rowid)
+        self._next_chunk_start = start_rowid
+
+    def _get_from_chunk(self, idx: int) -> dict:
+        """
+        Retrieve a spectrum from the current chunk.
+
+        Args:
+            idx (int): The index of the spectrum to retrieve.
+
+        Returns:
+            dict: The retrieved spectrum as a dictionary.
+        """
+        # NumPy integers would be bound as NumPy types in the chunk queries
+        idx = operator.index(idx)
+        chunk_start = (idx // self.chunk_size) * self.chunk_size
+
+        # If the index is outside the current chunk, load the appropriate chunk
+        if not self.current_chunk or idx < self.current_chunk_start or idx >= self.current_chunk_start + len(self.current_chunk):
+            self._load_chunk(chunk_start)
+
+        # Adjust the index relative to the current chunk and return the spectrum
+        relative_idx = idx - self.current_chunk_start
+        next_start = self.current_chunk_start + self.chunk_size
+        if self._next_chunk is None and relative_idx >= _PREFETCH_FRACTION * self.chunk_size and next_start < len(self):
+            self._prefetch_chunk(next_start)
+        return self.current_chunk[relative_idx]
+
+    def __len__(self):
+        """
+        Get the number of spectra in the dataset.
+
+        Returns:
+            int: The number of spectra.
+        """
+        if self._n is None:
+            self._n = self.conn.execute(COUNT_QUERY).fetchone()[0]
+        return self._n
+
+    def __enter__(self):
+        """
+        Enable the use of the dataset as a context manager.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Ensure the connections are closed when exiting the context.
+        """
+        self.close()
+
+    def close(self):
+        """
+        Close the DuckDB connection and stop the prefetch thread.
+        """
+        if self._prefetch_pool is not None:
+            self._prefetch_pool.shutdown(wait=True)
+            self._prefetch_pool = None
+            self._next_chunk = None
+        if self._prefetch_conn is not None:
+            self._prefetch_conn.close()
+            self._prefetch_conn = None
+        if self.conn:
+            self.conn.close()
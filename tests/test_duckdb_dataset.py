@@ -1,13 +1,12 @@
-import os
+import duckdb
+import numpy as np
 import pytest
 from msms_spectra_dataset.duckdb_dataset import DuckDBSpectraDataset
 
 DUCKDB_FILE = "test_spectra.duckdb"
 
-def test_empty_dataset():
-    if os.path.exists(DUCKDB_FILE):
-        os.remove(DUCKDB_FILE)
-    ds = DuckDBSpectraDataset(DUCKDB_FILE, [])
+def test_empty_dataset(tmp_path):
+    ds = DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [])
     assert len(ds) == 0
 
 def test_load_single_spectrum(tmp_path):
@@ -21,9 +20,7 @@ END IONS
 """
     mgf_file = tmp_path / "test.mgf"
     mgf_file.write_text(mgf_content)
-    if os.path.exists(DUCKDB_FILE):
-        os.remove(DUCKDB_FILE)
-    ds = DuckDBSpectraDataset(DUCKDB_FILE, [str(mgf_file)])
+    ds = DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [str(mgf_file)])
     assert len(ds) == 1
     spec = ds[0]
     assert spec["id"] == "TestSpectrum"
@@ -49,9 +46,7 @@ END IONS
 """
     mgf_file = tmp_path / "multiple_spectra.mgf"
     mgf_file.write_text(mgf_content)
-    if os.path.exists(DUCKDB_FILE):
-        os.remove(DUCKDB_FILE)
-    ds = DuckDBSpectraDataset(DUCKDB_FILE, [str(mgf_file)])
+    ds = DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [str(mgf_file)])
     assert len(ds) == 2
 
     spec1 = ds[0]
@@ -78,9 +73,7 @@ END IONS
 """
     mgf_file = tmp_path / "invalid_charge.mgf"
     mgf_file.write_text(mgf_content)
-    if os.path.exists(DUCKDB_FILE):
-        os.remove(DUCKDB_FILE)
-    ds = DuckDBSpectraDataset(DUCKDB_FILE, [str(mgf_file)])
+    ds = DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [str(mgf_file)])
     assert len(ds) == 1
     spec = ds[0]
     assert spec["id"] == "InvalidCharge"
@@ -105,9 +98,7 @@ END IONS
 """
     mgf_file = tmp_path / "query_spectra.mgf"
     mgf_file.write_text(mgf_content)
-    if os.path.exists(DUCKDB_FILE):
-        os.remove(DUCKDB_FILE)
-    ds = DuckDBSpectraDataset(DUCKDB_FILE, [str(mgf_file)])
+    ds = DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [str(mgf_file)])
 
     # Query spectra with precursor_mz > 500
     filtered = ds.query("precursor_mz > 500")
@@ -116,3 +107,127 @@ END IONS
     assert filtered[0]["precursor_mz"] == pytest.approx(600.75, rel=1e-6)
 
 
+
+def test_array_indexing(tmp_path):
+    mgf_content = """BEGIN IONS
+TITLE=Spectrum1
+PEPMASS=400.5
+CHARGE=3+
+123.45 678.90
+END IONS
+BEGIN IONS
+TITLE=Spectrum2
+PEPMASS=600.75
+CHARGE=2+
+223.45 778.90
+END IONS
+"""
+    mgf_file = tmp_path / "array_indexing.mgf"
+    mgf_file.write_text(mgf_content)
+    with DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [str(mgf_file)]) as ds:
+        batch = ds[np.array([0, 1])]
+        assert [spec["id"] for spec in batch] == ["Spectrum1", "Spectrum2"]
+        assert ds[np.array([1])][0]["mz"][0] == pytest.approx(223.45, rel=1e-6)
+        assert ds[np.array([], dtype=np.int64)] == []
+
+def test_batch_arrow(tmp_path):
+    mgf_content = """BEGIN IONS
+TITLE=Spectrum1
+PEPMASS=400.5
+CHARGE=3+
+123.45 678.90
+END IONS
+BEGIN IONS
+TITLE=Spectrum2
+PEPMASS=600.75
+CHARGE=2+
+223.45 778.90
+323.45 878.90
+END IONS
+"""
+    mgf_file = tmp_path / "batch_arrow.mgf"
+    mgf_file.write_text(mgf_content)
+    with DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [str(mgf_file)]) as ds:
+        table = ds.get_batch_arrow(np.array([1, 0]))
+        assert table.num_rows == 2
+        assert table.column("rowid").to_pylist() == [0, 1]
+        assert table.column("id").to_pylist() == ["Spectrum1", "Spectrum2"]
+        assert table.column("mz").to_pylist()[1] == pytest.approx([223.45, 323.45], rel=1e-6)
+        assert ds.get_batch_arrow([]).num_rows == 0
+
+def test_sequential_mode(tmp_path):
+    mgf_content = """BEGIN IONS
+TITLE=Spectrum1
+PEPMASS=400.5
+CHARGE=3+
+123.45 678.90
+END IONS
+BEGIN IONS
+TITLE=NoPeaks
+PEPMASS=500.5
+CHARGE=2+
+END IONS
+BEGIN IONS
+TITLE=Spectrum3
+PEPMASS=600.75
+CHARGE=2+
+223.45 778.90
+323.45 878.90
+END IONS
+"""
+    mgf_file = tmp_path / "sequential.mgf"
+    mgf_file.write_text(mgf_content)
+    with DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [str(mgf_file)], sequential_mode=True, chunk_size=2) as ds:
+        batch = ds[0:3]
+        assert [spec["id"] for spec in batch] == ["Spectrum1", "NoPeaks", "Spectrum3"]
+        assert len(batch[1]["mz"]) == 0
+        assert list(batch[2]["mz"]) == pytest.approx([223.45, 323.45], rel=1e-6)
+        assert list(batch[2]["intensity"]) == pytest.approx([778.90, 878.90], rel=1e-6)
+        assert batch[2]["mz"].dtype == np.float32
+        ds.sequential_mode = False
+        assert [len(spec["mz"]) for spec in ds[[0, 1, 2]]] == [1, 0, 2]
+        assert isinstance(ds[2]["intensity"], np.ndarray) and ds[2]["intensity"].dtype == np.float32
+
+def test_sequential_prefetch(tmp_path):
+    mgf_file = tmp_path / "prefetch.mgf"
+    mgf_file.write_text("".join(
+        f"BEGIN IONS\nTITLE=Spectrum{i}\nPEPMASS={400 + i}\n{100 + i} 10\nEND IONS\n" for i in range(12)
+    ))
+    with DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [str(mgf_file)], sequential_mode=True, chunk_size=5) as ds:
+        spectra = [ds[i] for i in range(len(ds))]
+        assert [spec["id"] for spec in spectra] == [f"Spectrum{i}" for i in range(12)]
+        assert [spec["mz"][0] for spec in spectra] == pytest.approx([100 + i for i in range(12)])
+        # Jumping back to the first chunk ignores the prefetched chunk
+        assert ds[3]["id"] == "Spectrum3"
+
+def test_sequential_mode_numpy_indices(tmp_path):
+    mgf_file = tmp_path / "numpy_indices.mgf"
+    mgf_file.write_text("".join(
+        f"BEGIN IONS\nTITLE=Spectrum{i}\nPEPMASS={400 + i}\n{100 + i} 10\nEND IONS\n" for i in range(12)
+    ))
+    with DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [str(mgf_file)], sequential_mode=True, chunk_size=5) as ds:
+        assert ds[np.int64(7)]["id"] == "Spectrum7"
+        assert [spec["id"] for spec in ds[np.array([1, 11])]] == ["Spectrum1", "Spectrum11"]
+
+def test_legacy_list_schema(tmp_path):
+    duckdb_file = str(tmp_path / "legacy.duckdb")
+    conn = duckdb.connect(duckdb_file)
+    conn.execute("""
+        CREATE TABLE spectra (
+            id TEXT, precursor_mz REAL, precursor_charge INTEGER, retention_time REAL, mz REAL[], intensity REAL[]
+        )
+    """)
+    conn.close()
+    with pytest.raises(ValueError, match="recreate"):
+        DuckDBSpectraDataset(duckdb_file)
+
+def test_slice_bounds(tmp_path):
+    mgf_file = tmp_path / "slices.mgf"
+    mgf_file.write_text("".join(
+        f"BEGIN IONS\nTITLE=Spectrum{i}\nPEPMASS={400 + i}\n{100 + i} 10\nEND IONS\n" for i in range(5)
+    ))
+    with DuckDBSpectraDataset(str(tmp_path / DUCKDB_FILE), [str(mgf_file)]) as ds:
+        assert [spec["id"] for spec in ds[-2:]] == ["Spectrum3", "Spectrum4"]
+        assert [spec["id"] for spec in ds[1:-3]] == ["Spectrum1"]
+        assert [spec["id"] for spec in ds[3:100]] == ["Spectrum3", "Spectrum4"]
+        assert ds[10:] == []
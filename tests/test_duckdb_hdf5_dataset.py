@@ -1,4 +1,5 @@
-import os
+import h5py
+import numpy as np
 import pytest
 from msms_spectra_dataset.duckdb_hdf5_dataset import DuckDBHDF5SpectraDataset
 
@@ -17,11 +18,7 @@ END IONS
 """
     mgf_file = tmp_path / "test.mgf"
     mgf_file.write_text(mgf_content)
-    if os.path.exists(DUCKDB_FILE):
-        os.remove(DUCKDB_FILE)
-    if os.path.exists(HDF5_FILE):
-        os.remove(HDF5_FILE)
-    with DuckDBHDF5SpectraDataset(DUCKDB_FILE, HDF5_FILE, [str(mgf_file)]) as ds:
+    with DuckDBHDF5SpectraDataset(str(tmp_path / DUCKDB_FILE), str(tmp_path / HDF5_FILE), [str(mgf_file)]) as ds:
         assert len(ds) == 1
         spec = ds[0]
         assert spec["id"] == "TestSpectrum"
@@ -47,11 +44,7 @@ END IONS
 """
     mgf_file = tmp_path / "multiple_spectra.mgf"
     mgf_file.write_text(mgf_content)
-    if os.path.exists(DUCKDB_FILE):
-        os.remove(DUCKDB_FILE)
-    if os.path.exists(HDF5_FILE):
-        os.remove(HDF5_FILE)
-    with DuckDBHDF5SpectraDataset(DUCKDB_FILE, HDF5_FILE, [str(mgf_file)]) as ds:
+    with DuckDBHDF5SpectraDataset(str(tmp_path / DUCKDB_FILE), str(tmp_path / HDF5_FILE), [str(mgf_file)]) as ds:
         assert len(ds) == 2
         spec1 = ds[0]
         spec2 = ds[1]
@@ -72,11 +65,7 @@ END IONS
 """
     mgf_file = tmp_path / "invalid_charge.mgf"
     mgf_file.write_text(mgf_content)
-    if os.path.exists(DUCKDB_FILE):
-        os.remove(DUCKDB_FILE)
-    if os.path.exists(HDF5_FILE):
-        os.remove(HDF5_FILE)
-    with DuckDBHDF5SpectraDataset(DUCKDB_FILE, HDF5_FILE, [str(mgf_file)]) as ds:
+    with DuckDBHDF5SpectraDataset(str(tmp_path / DUCKDB_FILE), str(tmp_path / HDF5_FILE), [str(mgf_file)]) as ds:
         assert len(ds) == 1
         spec = ds[0]
         assert spec["id"] == "InvalidCharge"
@@ -101,11 +90,7 @@ END IONS
 """
     mgf_file = tmp_path / "query_spectra.mgf"
     mgf_file.write_text(mgf_content)
-    if os.path.exists(DUCKDB_FILE):
-        os.remove(DUCKDB_FILE)
-    if os.path.exists(HDF5_FILE):
-        os.remove(HDF5_FILE)
-    with DuckDBHDF5SpectraDataset(DUCKDB_FILE, HDF5_FILE, [str(mgf_file)]) as ds:
+    with DuckDBHDF5SpectraDataset(str(tmp_path / DUCKDB_FILE), str(tmp_path / HDF5_FILE), [str(mgf_file)]) as ds:
         # Query spectra with precursor_mz > 500
         filtered = ds.query("precursor_mz > 500")
         assert len(filtered) == 1
@@ -113,3 +98,100 @@ END IONS
         assert filtered[0]["precursor_mz"] == pytest.approx(600.75, rel=1e-6)
 
 
+
+def test_array_indexing(tmp_path):
+    mgf_content = """BEGIN IONS
+TITLE=Spectrum1
+PEPMASS=400.5
+CHARGE=3+
+123.45 678.90
+END IONS
+BEGIN IONS
+TITLE=Spectrum2
+PEPMASS=600.75
+CHARGE=2+
+223.45 778.90
+END IONS
+"""
+    mgf_file = tmp_path / "array_indexing.mgf"
+    mgf_file.write_text(mgf_content)
+    with DuckDBHDF5SpectraDataset(str(tmp_path / DUCKDB_FILE), str(tmp_path / HDF5_FILE), [str(mgf_file)]) as ds:
+        batch = ds[np.array([0, 1])]
+        assert [spec["id"] for spec in batch] == ["Spectrum1", "Spectrum2"]
+        assert ds[np.array([1])][0]["mz"][0] == pytest.approx(223.45, rel=1e-6)
+        assert ds[np.array([], dtype=np.int64)] == []
+
+def test_sequential_mode(tmp_path):
+    mgf_content = """BEGIN IONS
+TITLE=Spectrum1
+PEPMASS=400.5
+CHARGE=3+
+123.45 678.90
+END IONS
+BEGIN IONS
+TITLE=NoPeaks
+PEPMASS=500.5
+CHARGE=2+
+END IONS
+BEGIN IONS
+TITLE=Spectrum3
+PEPMASS=600.75
+CHARGE=2+
+223.45 778.90
+323.45 878.90
+END IONS
+"""
+    mgf_file = tmp_path / "sequential.mgf"
+    mgf_file.write_text(mgf_content)
+    with DuckDBHDF5SpectraDataset(str(tmp_path / DUCKDB_FILE), str(tmp_path / HDF5_FILE), [str(mgf_file)], sequential_mode=True, chunk_size=2) as ds:
+        batch = ds[0:3]
+        assert [spec["id"] for spec in batch] == ["Spectrum1", "NoPeaks", "Spectrum3"]
+        assert len(batch[1]["mz"]) == 0
+        assert list(batch[2]["mz"]) == pytest.approx([223.45, 323.45], rel=1e-6)
+        assert list(batch[2]["intensity"]) == pytest.approx([778.90, 878.90], rel=1e-6)
+        assert batch[2]["mz"].dtype == np.float32 and batch[2]["intensity"].dtype == np.float32
+        ds.sequential_mode = False
+        assert [len(spec["mz"]) for spec in ds[[0, 2]]] == [1, 2]
+        assert ds.h5["mz_values"].dtype == np.float32 and ds.h5["intensity_values"].dtype == np.float32
+        assert [spec["id"] for spec in ds[[2, 0, 2]]] == ["Spectrum1", "Spectrum3", "Spectrum3"]
+        assert [len(spec["mz"]) for spec in ds[[2, 1, 2]]] == [0, 2, 2]
+        with pytest.raises(IndexError):
+            ds[[3]]
+
+def test_sequential_prefetch(tmp_path):
+    mgf_file = tmp_path / "prefetch.mgf"
+    mgf_file.write_text("".join(
+        f"BEGIN IONS\nTITLE=Spectrum{i}\nPEPMASS={400 + i}\n{100 + i} 10\nEND IONS\n" for i in range(12)
+    ))
+    with DuckDBHDF5SpectraDataset(str(tmp_path / DUCKDB_FILE), str(tmp_path / HDF5_FILE), [str(mgf_file)], sequential_mode=True, chunk_size=5) as ds:
+        spectra = [ds[i] for i in range(len(ds))]
+        assert [spec["id"] for spec in spectra] == [f"Spectrum{i}" for i in range(12)]
+        assert [spec["mz"][0] for spec in spectra] == pytest.approx([100 + i for i in range(12)])
+        assert ds[3]["id"] == "Spectrum3"
+
+def test_sequential_mode_numpy_indices(tmp_path):
+    mgf_file = tmp_path / "numpy_indices.mgf"
+    mgf_file.write_text("".join(
+        f"BEGIN IONS\nTITLE=Spectrum{i}\nPEPMASS={400 + i}\n{100 + i} 10\nEND IONS\n" for i in range(12)
+    ))
+    with DuckDBHDF5SpectraDataset(str(tmp_path / DUCKDB_FILE), str(tmp_path / HDF5_FILE), [str(mgf_file)], sequential_mode=True, chunk_size=5) as ds:
+        assert ds[np.int64(7)]["id"] == "Spectrum7"
+        assert [spec["id"] for spec in ds[np.array([1, 11])]] == ["Spectrum1", "Spectrum11"]
+
+def test_legacy_vlen_layout(tmp_path):
+    hdf5_file = str(tmp_path / "legacy.hdf5")
+    with h5py.File(hdf5_file, "w") as f:
+        f.create_dataset("spectra", shape=(1, 2), dtype=h5py.vlen_dtype(np.float32))
+    with pytest.raises(ValueError, match="offsets"):
+        DuckDBHDF5SpectraDataset(str(tmp_path / "legacy.duckdb"), hdf5_file)
+
+def test_slice_bounds(tmp_path):
+    mgf_file = tmp_path / "slices.mgf"
+    mgf_file.write_text("".join(
+        f"BEGIN IONS\nTITLE=Spectrum{i}\nPEPMASS={400 + i}\n{100 + i} 10\nEND IONS\n" for i in range(5)
+    ))
+    with DuckDBHDF5SpectraDataset(str(tmp_path / DUCKDB_FILE), str(tmp_path / HDF5_FILE), [str(mgf_file)]) as ds:
+        assert [spec["id"] for spec in ds[-2:]] == ["Spectrum3", "Spectrum4"]
+        assert [spec["id"] for spec in ds[1:-3]] == ["Spectrum1"]
+        assert [spec["id"] for spec in ds[3:100]] == ["Spectrum3", "Spectrum4"]
+        assert ds[10:] == []
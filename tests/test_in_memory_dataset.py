@@ -1,4 +1,6 @@
 from msms_spectra_dataset.in_memory_dataset import InMemoryMGFSpectraDataset
+from msms_spectra_dataset.mgf_parser import parse_mgf_files
+import numpy as np
 import pytest
 
 def test_empty_dataset():
@@ -116,7 +118,228 @@ END IONS
     ds = InMemoryMGFSpectraDataset([str(mgf_file)])
 
     # Query spectra with precursor_mz > 500
-    filtered = ds.query(lambda s: s.precursor_mz > 500)
+    with pytest.warns(DeprecationWarning):
+        filtered = ds.query(lambda s: s.precursor_mz > 500)
     assert len(filtered) == 1
     assert filtered[0].identifier == "Spectrum2"
     assert filtered[0].precursor_mz == pytest.approx(600.75, rel=1e-6)
+
+def test_query_expression(tmp_path):
+    mgf_content = """BEGIN IONS
+TITLE=Spectrum1
+PEPMASS=400.5
+CHARGE=3+
+123.45 678.90
+END IONS
+BEGIN IONS
+TITLE=Spectrum2
+PEPMASS=600.75
+CHARGE=2+
+223.45 778.90
+323.45 878.90
+END IONS
+"""
+    mgf_file = tmp_path / "query_expression.mgf"
+    mgf_file.write_text(mgf_content)
+    ds = InMemoryMGFSpectraDataset([str(mgf_file)])
+
+    assert list(ds.query("precursor_mz > 500")) == [1]
+    assert list(ds.query("precursor_mz > 300 and precursor_charge == 3")) == [0]
+    assert list(ds.query("(precursor_charge == 2) | (precursor_charge == 3)")) == [0, 1]
+    assert len(ds.query("precursor_mz > 1000")) == 0
+    assert list(ds.query_expr("not precursor_charge == 2")) == [0]
+    assert list(ds.query_expr("~(precursor_charge == 2) | (precursor_mz * 2 > 1200)")) == [0, 1]
+    with pytest.raises(ValueError):
+        ds.query_expr("unknown_column > 1")
+
+    spec2 = ds[-1]
+    assert spec2.identifier == "Spectrum2"
+    assert len(spec2.mz) == 2
+    assert spec2.mz[1] == pytest.approx(323.45, rel=1e-6)
+    assert [spec.identifier for spec in ds[0:2]] == ["Spectrum1", "Spectrum2"]
+
+def test_query_zone_skipping(tmp_path):
+    # Precursor m/z increases with the index, so most zones can be skipped
+    n_spectra = 10000
+    mgf_file = tmp_path / "zones.mgf"
+    mgf_file.write_text("".join(
+        f"BEGIN IONS\nTITLE=S{i}\nPEPMASS={100 + i * 0.1:.1f}\nCHARGE={i % 3 + 1}+\nRTINSECONDS={i * 0.1:.1f}\n100.0 1.0\nEND IONS\n"
+        for i in range(n_spectra)
+    ))
+    ds = InMemoryMGFSpectraDataset([str(mgf_file)])
+    mz = 100 + np.arange(n_spectra) * 0.1
+    charge = np.arange(n_spectra) % 3 + 1
+
+    assert np.array_equal(ds.query_expr("precursor_mz > 1000.05"), np.flatnonzero(mz > 1000.05))
+    assert np.array_equal(ds.query_expr("500.05 < precursor_mz <= 600.05"), np.flatnonzero((mz > 500.05) & (mz <= 600.05)))
+    assert np.array_equal(
+        ds.query_expr("(precursor_mz < 200.05) & (precursor_charge == 2)"),
+        np.flatnonzero((mz < 200.05) & (charge == 2)),
+    )
+    assert np.array_equal(
+        ds.query_expr("precursor_mz < 150.05 or precursor_mz > 1090.05"),
+        np.flatnonzero((mz < 150.05) | (mz > 1090.05)),
+    )
+    assert len(ds.query_expr("precursor_mz == 5000")) == 0
+    # Chains starting with a constant are pruned on every bound and keep comparing the column
+    assert np.array_equal(ds.query_expr("500.05 < precursor_mz <= 510.05"), np.flatnonzero((mz > 500.05) & (mz <= 510.05)))
+    assert np.array_equal(ds.query_expr("500 < precursor_mz > retention_time"), np.flatnonzero((mz > 500) & (mz > np.arange(n_spectra) * 0.1)))
+
+def test_query_numexpr(tmp_path):
+    pytest.importorskip("numexpr")
+    n_spectra = 10000
+    mgf_file = tmp_path / "numexpr.mgf"
+    mgf_file.write_text("".join(
+        f"BEGIN IONS\nTITLE=S{i}\nPEPMASS={100 + i * 0.1:.1f}\nCHARGE={i % 3 + 1}+\n100.0 1.0\nEND IONS\n"
+        for i in range(n_spectra)
+    ))
+    ds = InMemoryMGFSpectraDataset([str(mgf_file)])
+    mz = 100 + np.arange(n_spectra) * 0.1
+    charge = np.arange(n_spectra) % 3 + 1
+
+    # Evaluated with numexpr
+    assert np.array_equal(
+        ds.query_expr("(precursor_mz > 500.05) & (precursor_charge == 2)"),
+        np.flatnonzero((mz > 500.05) & (charge == 2)),
+    )
+    # Chained comparisons are not supported by numexpr and fall back to NumPy
+    assert np.array_equal(ds.query_expr("500.05 < precursor_mz <= 600.05"), np.flatnonzero((mz > 500.05) & (mz <= 600.05)))
+
+def test_mgf_format_variants(tmp_path):
+    mgf_content = (
+        "BEGIN IONS\r\n"
+        "TITLE=Crlf Spectrum\r\n"
+        "PEPMASS=500.25\r\n"
+        "CHARGE=2-\r\n"
+        "123.45 678.90 1+\r\n"
+        "1.5e2 2E3\r\n"
+        "END IONS\r\n"
+    )
+    mgf_file = tmp_path / "variants.mgf"
+    mgf_file.write_bytes(mgf_content.encode())
+    ds = InMemoryMGFSpectraDataset([str(mgf_file)])
+    assert len(ds) == 1
+    spec = ds[0]
+    assert spec.identifier == "Crlf Spectrum"
+    assert spec.precursor_charge == -2
+    assert spec.precursor_intensity is None
+    assert list(spec.mz) == pytest.approx([123.45, 150.0], rel=1e-6)
+    assert list(spec.intensity) == pytest.approx([678.90, 2000.0], rel=1e-6)
+
+def test_multiple_files_in_parallel(tmp_path):
+    mgf_files = []
+    for i in range(3):
+        mgf_file = tmp_path / f"file{i}.mgf"
+        mgf_file.write_text(f"""BEGIN IONS
+TITLE=File{i}
+PEPMASS={400 + i}
+CHARGE=2+
+{100 + i} 10
+{200 + i} 20
+END IONS
+""")
+        mgf_files.append(str(mgf_file))
+    ds = InMemoryMGFSpectraDataset(mgf_files, num_workers=2)
+    assert len(ds) == 3
+    for i in range(3):
+        assert ds[i].identifier == f"File{i}"
+        assert ds[i].precursor_mz == pytest.approx(400 + i, rel=1e-6)
+        assert list(ds[i].mz) == pytest.approx([100 + i, 200 + i], rel=1e-6)
+
+def test_arrow_cache(tmp_path):
+    mgf_file = tmp_path / "cached.mgf"
+    mgf_file.write_text("""BEGIN IONS
+TITLE=Cached
+PEPMASS=500.25 1000
+CHARGE=2+
+RTINSECONDS=100
+123.45 678.90
+END IONS
+""")
+    ds = InMemoryMGFSpectraDataset([str(mgf_file)], cache=True)
+    assert (tmp_path / "cached.mgf.arrow").exists()
+
+    cached = InMemoryMGFSpectraDataset([str(mgf_file)], cache=True)
+    assert len(cached) == len(ds) == 1
+    spec = cached[0]
+    assert spec.identifier == "Cached"
+    assert spec.precursor_intensity == pytest.approx(1000, rel=1e-6)
+    assert spec.retention_time == pytest.approx(100, rel=1e-6)
+    assert spec.mz[0] == pytest.approx(123.45, rel=1e-6)
+
+    # Modifying the MGF file invalidates the cache
+    mgf_file.write_text(mgf_file.read_text().replace("TITLE=Cached", "TITLE=Modified!"))
+    assert InMemoryMGFSpectraDataset([str(mgf_file)], cache=True)[0].identifier == "Modified!"
+
+def test_batch_views(tmp_path):
+    mgf_content = "".join(f"""BEGIN IONS
+TITLE=Spectrum{i}
+PEPMASS={400 + i}
+CHARGE=2+
+{"".join(f"{100 + 10 * i + j} {j + 1}{chr(10)}" for j in range(i))}END IONS
+""" for i in range(5))
+    mgf_file = tmp_path / "batches.mgf"
+    mgf_file.write_text(mgf_content)
+    ds = InMemoryMGFSpectraDataset([str(mgf_file)])
+
+    batch = ds[1:4]
+    assert len(batch) == 3
+    assert list(batch.offsets) == [0, 1, 3, 6]
+    assert batch.mz_values[0] == pytest.approx(110, rel=1e-6)
+    assert batch.precursor_mz == pytest.approx([401, 402, 403], rel=1e-6)
+    assert [spec.identifier for spec in batch] == ["Spectrum1", "Spectrum2", "Spectrum3"]
+    assert batch[-1].mz == pytest.approx([130, 131, 132], rel=1e-6)
+
+    gathered = ds[[4, 0, 2]]
+    assert [spec.identifier for spec in gathered] == ["Spectrum4", "Spectrum0", "Spectrum2"]
+    assert list(gathered.offsets) == [0, 4, 4, 6]
+    assert gathered[0].mz == pytest.approx([140, 141, 142, 143], rel=1e-6)
+    assert gathered[2].intensity == pytest.approx([1, 2], rel=1e-6)
+
+    assert [spec.identifier for spec in ds[::2]] == ["Spectrum0", "Spectrum2", "Spectrum4"]
+    assert len(ds[10:]) == 0
+    with pytest.raises(IndexError):
+        ds[5]
+
+    masked = ds[np.array([True, False, True, False, False])]
+    assert [spec.identifier for spec in masked] == ["Spectrum0", "Spectrum2"]
+    assert list(masked.offsets) == [0, 0, 2]
+    with pytest.raises(IndexError):
+        ds[np.array([True, False, True])]
+
+def test_repeated_files(tmp_path):
+    mgf_file = tmp_path / "repeated.mgf"
+    mgf_file.write_text("""BEGIN IONS
+TITLE=Spectrum1
+PEPMASS=400.5
+CHARGE=3+
+123.45 678.90
+END IONS
+BEGIN IONS
+TITLE=Spectrum2
+PEPMASS=600.75
+CHARGE=2+
+223.45 778.90
+323.45 878.90
+END IONS
+""")
+    ds = InMemoryMGFSpectraDataset([str(mgf_file)] * 3)
+    assert len(ds) == 6
+    assert list(ds.columns.offsets) == [0, 1, 3, 4, 6, 7, 9]
+    assert [spec.identifier for spec in ds] == ["Spectrum1", "Spectrum2"] * 3
+    assert ds[5].mz == pytest.approx([223.45, 323.45], rel=1e-6)
+
+def test_arrow_cache_in_parallel(tmp_path):
+    mgf_files = []
+    for i in range(3):
+        mgf_file = tmp_path / f"file{i}.mgf"
+        mgf_file.write_text(f"BEGIN IONS\nTITLE=File{i}\nPEPMASS={400 + i}\n{100 + i} 10\nEND IONS\n")
+        mgf_files.append(str(mgf_file))
+    parse_mgf_files(mgf_files[:1], cache=True)
+
+    parsed = parse_mgf_files(mgf_files, num_workers=2, cache=True)
+    assert list(parsed) == mgf_files
+    assert all((tmp_path / f"file{i}.mgf.arrow").exists() for i in range(3))
+    # Cache hits are read in the calling process and stay memory-mapped rather than copied
+    assert not parsed[mgf_files[0]].mz_values.flags.writeable
+    assert [float(parsed[file].mz_values[0]) for file in mgf_files] == pytest.approx([100, 101, 102])
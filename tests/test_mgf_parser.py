@@ -0,0 +1,27 @@
+from msms_spectra_dataset.mgf_parser import parse_mgf_file
+import numpy as np
+import pytest
+
+VALUES = [
+    "500.25", "1e-3", "1E+05", "2.5e3", "+12.5", "-12.5", ".5", "7.",
+    # Beyond Clinger's fast path: too many significant digits or too large exponents
+    "123.456789012345678901234", "0.1000000000000000055511151231257827", "9007199254740993",
+    "1e-30", "3.4028234e38",
+    "nan", "NaN", "inf", "-inf", "+Infinity",
+]
+
+@pytest.mark.parametrize("value", VALUES)
+def test_number_parsing(tmp_path, value):
+    mgf_file = tmp_path / "numbers.mgf"
+    mgf_file.write_text(f"BEGIN IONS\nPEPMASS={value} {value}\nRTINSECONDS={value}\n100 {value}\nEND IONS\n")
+    columns = parse_mgf_file(str(mgf_file))
+    expected = np.float32(float(value))
+    for parsed in (columns.precursor_mz[0], columns.precursor_intensity[0], columns.retention_time[0],
+                   columns.intensity_values[0]):
+        np.testing.assert_equal(parsed, expected)
+
+@pytest.mark.parametrize("charge, expected", [("2+", 2), ("3-", -3), ("12+", 12), ("127-", -127), ("128+", 0), ("2", 0), ("+2", 0)])
+def test_charge_parsing(tmp_path, charge, expected):
+    mgf_file = tmp_path / "charges.mgf"
+    mgf_file.write_text(f"BEGIN IONS\nPEPMASS=500\nCHARGE={charge}\n100 1\nEND IONS\n")
+    assert parse_mgf_file(str(mgf_file)).precursor_charge[0] == expected
@@ -1,3 +1,4 @@
+import pickle
 from msms_spectra_dataset.on_demand_dataset import OnDemandMGFSpectraDataset
 import pytest
 
@@ -77,3 +78,98 @@ END IONS
     assert spec2.mz[0] == pytest.approx(223.45, rel=1e-6)
     assert spec2.intensity[0] == pytest.approx(778.90, rel=1e-6)
 
+
+def test_repeated_files_and_byte_offsets(tmp_path):
+    mgf_content = """BEGIN IONS
+TITLE=Spectrum1 µ-scan
+PEPMASS=400.5
+CHARGE=3+
+123.45 678.90
+END IONS
+BEGIN IONS
+TITLE=Spectrum2
+PEPMASS=600.75
+CHARGE=2+
+223.45 778.90
+END IONS
+"""
+    mgf_file = tmp_path / "repeated.mgf"
+    mgf_file.write_text(mgf_content, encoding="utf-8")
+    ds = OnDemandMGFSpectraDataset([str(mgf_file), str(mgf_file)])
+    assert len(ds) == 4
+    assert [spec.identifier for spec in ds[1:4]] == ["Spectrum2", "Spectrum1 µ-scan", "Spectrum2"]
+    assert ds[-1].precursor_mz == pytest.approx(600.75, rel=1e-6)
+    with pytest.raises(IndexError):
+        ds[4]
+
+def test_mgf_format_variants(tmp_path):
+    mgf_content = (
+        "BEGIN IONS\r\n"
+        "TITLE=Crlf Spectrum\r\n"
+        "PEPMASS=500.25\r\n"
+        "CHARGE=2-\r\n"
+        "123.45 678.90 1+\r\n"
+        "1.5e2 2E3\r\n"
+        "END IONS\r\n"
+        "BEGIN IONS\n"
+        "TITLE=InvalidCharge\n"
+        "PEPMASS=600.5 1000\n"
+        "CHARGE=invalid\n"
+        "100.5 10\n"
+        "END IONS\n"
+    )
+    mgf_file = tmp_path / "variants.mgf"
+    mgf_file.write_bytes(mgf_content.encode())
+    ds = OnDemandMGFSpectraDataset([str(mgf_file)])
+    assert len(ds) == 2
+    spec = ds[0]
+    assert spec.identifier == "Crlf Spectrum"
+    assert spec.precursor_charge == -2
+    assert spec.precursor_intensity is None
+    assert list(spec.mz) == pytest.approx([123.45, 150.0], rel=1e-6)
+    assert list(spec.intensity) == pytest.approx([678.90, 2000.0], rel=1e-6)
+    spec = ds[1]
+    assert spec.precursor_charge == 0
+    assert spec.precursor_intensity == pytest.approx(1000, rel=1e-6)
+    assert list(spec.mz) == pytest.approx([100.5], rel=1e-6)
+
+def test_empty_file_and_pickling(tmp_path):
+    empty_file = tmp_path / "empty.mgf"
+    empty_file.write_bytes(b"")
+    mgf_file = tmp_path / "test.mgf"
+    mgf_file.write_text("BEGIN IONS\nTITLE=Pickled\nPEPMASS=500.25\n123.45 678.90\nEND IONS\n")
+    with OnDemandMGFSpectraDataset([str(empty_file), str(mgf_file)]) as ds:
+        assert len(ds) == 1
+        copy = pickle.loads(pickle.dumps(ds))
+        assert copy[0].identifier == "Pickled"
+        copy.close()
+
+def test_charge_sanitation(tmp_path):
+    charges = ["2", "2+ and 3+", "+2", "130+", "0002+", " 3- "]
+    mgf_file = tmp_path / "charges.mgf"
+    mgf_file.write_text("".join(
+        f"BEGIN IONS\nTITLE=Spectrum{i}\nPEPMASS=500.25\nCHARGE={charge}\n123.45 678.90\nEND IONS\n"
+        for i, charge in enumerate(charges)
+    ))
+    ds = OnDemandMGFSpectraDataset([str(mgf_file)])
+    assert [ds[i].precursor_charge for i in range(len(ds))] == [0, 0, 0, 0, 2, -3]
+
+def test_extra_columns_on_later_peak_lines(tmp_path):
+    mgf_file = tmp_path / "extra_columns.mgf"
+    mgf_file.write_text("BEGIN IONS\nTITLE=Mixed\nPEPMASS=500.25\n100 1\n200 2 1\n300 3 1\nEND IONS\n")
+    spec = OnDemandMGFSpectraDataset([str(mgf_file)])[0]
+    assert list(spec.mz) == pytest.approx([100, 200, 300])
+    assert list(spec.intensity) == pytest.approx([1, 2, 3])
+
+    # Non-numeric annotations on a later line
+    mgf_file.write_text("BEGIN IONS\nTITLE=Annotated\n100 1\n200 2 1+\n300 3 b3\nEND IONS\n")
+    spec = OnDemandMGFSpectraDataset([str(mgf_file)])[0]
+    assert list(spec.mz) == pytest.approx([100, 200, 300])
+    assert list(spec.intensity) == pytest.approx([1, 2, 3])
+
+def test_invalid_pepmass(tmp_path):
+    mgf_file = tmp_path / "invalid_pepmass.mgf"
+    mgf_file.write_text("BEGIN IONS\nTITLE=Bad\nPEPMASS=abc\n100 1\nEND IONS\n")
+    spec = OnDemandMGFSpectraDataset([str(mgf_file)])[0]
+    assert spec.precursor_mz == 0.0
+    assert list(spec.mz) == pytest.approx([100])
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from msms_spectra_dataset.utils import parse_params, parse_spectrum
+
+def _charge(charge):
+    return parse_params({"params": {"charge": charge}})[3]
+
+@pytest.mark.parametrize("charge, expected", [
+    ("2+", 2), ("3-", -3), ("12+", 12), ("12-", -12), ("2", 2), ("127-", -127),
+    ("200+", 0), ("200-", 0), ("abc", 0), ("+", 0), ("", 0),
+])
+def test_string_charges(charge, expected):
+    assert _charge(charge) == expected
+    assert _charge([charge]) == expected
+
+@pytest.mark.parametrize("charge, expected", [(0, 0), (2, 2), (-3, -3), (12, 12), (-127, -127), (200, 0), (-200, 0)])
+def test_int_charges(charge, expected):
+    result = _charge(charge)
+    assert isinstance(result, np.int8)
+    assert result == expected
+
+def test_parse_spectrum_charge():
+    spec = parse_spectrum({
+        "params": {"title": "Spectrum", "pepmass": (500.25, None), "charge": "12-"},
+        "m/z array": np.array([100.0], dtype=np.float32),
+        "intensity array": np.array([1.0], dtype=np.float32),
+    })
+    assert spec.precursor_charge == -12
+    assert spec.precursor_mz == pytest.approx(500.25)